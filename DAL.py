@@ -1,169 +1,1262 @@
 # A. Import the sqlite library
 import sqlite3
+import asyncio
+import functools
+import itertools
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import registry, timed_query
+
+#######################################################
+# 0. CONNECTION MANAGER
+#######################################################
+#   Every DAL function borrows a connection from a shared pool instead of
+#   opening (and re-parsing the schema of) a brand new one per call. The
+#   file and its tuning come from the environment; every connection the
+#   DAL opens is set up the same way by _openConnection.
+def _envNumber(name, default, kind=int):
+    return kind(os.environ.get(name, default))
+
+
+# Where the database lives (docker-compose points it at the ./data volume)
+DB_PATH = os.environ.get("DB_PATH", "projects.db")
+
+# How many idle connections we keep around for reuse
+POOL_SIZE = 8
+
+# Negative cache_size is in KiB, so this is an 8 MB page cache per connection
+CACHE_SIZE_KB = _envNumber("DB_CACHE_SIZE_KB", 8000)
+
+# Bytes of the file read through a shared memory map instead of read()
+# calls into each connection's own cache (0 turns it off)
+MMAP_SIZE = _envNumber("DB_MMAP_SIZE", 256 * 1024 * 1024)
+
+# Page size of a new database file; an existing one keeps its page size
+# until it is VACUUMed
+DB_PAGE_SIZE = _envNumber("DB_PAGE_SIZE", 4096)
+
+# WAL pages after which the committing connection checkpoints inline, and
+# the size (bytes) the WAL file is cut back to after a checkpoint
+WAL_AUTOCHECKPOINT = _envNumber("DB_WAL_AUTOCHECKPOINT", 1000)
+JOURNAL_SIZE_LIMIT = _envNumber("DB_JOURNAL_SIZE_LIMIT", 64 * 1024 * 1024)
+
+# Seconds between background checkpoints (section 14); 0 turns them off
+CHECKPOINT_INTERVAL = _envNumber("DB_CHECKPOINT_INTERVAL", 30.0, float)
+
+# Number of prepared statements sqlite3 keeps compiled per connection
+STATEMENT_CACHE_SIZE = 128
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_openConnections = set()
+_poolLock = threading.Lock()
+
+
+def _openConnection():
+    # A. Open the connection. check_same_thread is off because pooled
+    #    connections are handed to whichever thread asks next
+    conn = sqlite3.connect(DB_PATH,
+                           check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           factory=TimedConnection)
+
+    # B. Tune the connection once, when it is created. page_size has to
+    #    come before journal_mode, which writes the header of a new file
+    conn.execute(f"PRAGMA page_size={DB_PAGE_SIZE}")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA wal_autocheckpoint={WAL_AUTOCHECKPOINT}")
+    conn.execute(f"PRAGMA journal_size_limit={JOURNAL_SIZE_LIMIT}")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def _connect():
+    conn = _openConnection()
+    with _poolLock:
+        _openConnections.add(conn)
+    return conn
+
+
+def _discard(conn):
+    with _poolLock:
+        _openConnections.discard(conn)
+    conn.close()
+
+
+@contextmanager
+def getConnection():
+    """Borrow a pooled connection for the duration of a with block."""
+    # A. Reuse an idle connection if we have one, otherwise open a new one
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+
+    try:
+        yield conn
+    finally:
+        # B. Never hand a connection with a half-finished transaction back
+        if conn.in_transaction:
+            conn.rollback()
+
+        # C. Put it back in the pool, or close it if the pool is already full
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            _discard(conn)
+
+
+def closeAllConnections():
+    """Close every pooled connection (used at shutdown and after a fork)."""
+    while True:
+        try:
+            _pool.get_nowait()
+        except queue.Empty:
+            break
+
+    with _poolLock:
+        connections = list(_openConnections)
+        _openConnections.clear()
+
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            pass
+
+    # The cache watches the same file, so it has to start over too, and the
+    # in-memory snapshot may be a copy of a different file
+    resetCache()
+    _dropSnapshot()
+
+
+def forgetConnections():
+    """Drop every pooled connection without closing it (in a freshly forked child).
+
+    The handles belong to the parent: closing them in the child could
+    release SQLite locks the parent still holds, so the child just opens
+    its own from now on.
+    """
+    global _pool, _openConnections, _poolLock, _cacheWatcher, _cacheDataVersion, _cacheCheckedAt
+    _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+    _openConnections = set()
+    _poolLock = threading.Lock()
+    with _cacheLock:
+        _clearCache()
+        _cacheWatcher = None
+        _cacheDataVersion = None
+        _cacheCheckedAt = 0.0
+    _dropSnapshot()
 
 #######################################################
 # 1. ADD PROJECT TO DB
 #######################################################
+@timed_query(rows=lambda newId: 1)
 def saveProjectDB(Title, Description, ImageFileName):
-    #A. Make a connection to the database
-    conn = None
-    conn = sqlite3.connect("projects.db")
+    """Insert a project and return its new id."""
+    return _queueSaveProject(Title, Description, ImageFileName).result()
 
-    #B. Write a SQL statement to insert a specific row (based on Title name)
-    sql = 'INSERT INTO projects (Title, Description, ImageFileName) values (?,?,?)'
-
-    # B. Create a workspace (aka Cursor)
-    cur = conn.cursor()
 
-    # C. Run the SQL statement from above and pass it 1 parameter for each ?
-    cur.execute(sql, (Title, Description, ImageFileName,))
+def _queueSaveProject(Title, Description, ImageFileName):
+    # A. Write a SQL statement to insert a specific row (based on Title name)
+    sql = 'INSERT INTO projects (Title, Description, ImageFileName) values (?,?,?)'
 
-    # D. Save the changes
-    conn.commit()
-    if conn:
-        conn.close()
+    # B. Queue it for the writer, passing it 1 parameter for each ?. It is
+    #    committed together with any other writes queued at the same time,
+    #    and the cache is invalidated once the group is committed
+    return _groupCommit(sql, (_stripMarkers(Title), _stripMarkers(Description), ImageFileName,),
+                        lambda cur: cur.lastrowid)
 
 #######################################################
 # 2. SHOW PROJECTS IN A TABLE
 #######################################################
-#   THIS RETURNS AS LIST OF DICTIONARIES
-def getAllProjects():
-    # A. Connection to the database
-    conn = sqlite3.connect('projects.db')
+# Default and maximum number of projects on one page of the table
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
-    # B. Create a workspace (aka Cursor)
-    cursorObj = conn.cursor()
+# Rows pulled from the cursor at a time while iterating
+FETCH_BATCH_SIZE = 200
 
-    # D. Run the SQL Select statement to retrieve the data
-    cursorObj.execute('SELECT id, Title, Description, ImageFileName FROM projects;')
+# Characters of each Description the table view shows; the full text is
+# only read for a single project (getProjectById) or with full_text=True
+SNIPPET_LENGTH = 200
 
-    # E. Tell Python to 'fetch' all of the records and put them in
-    #     a list called allRows
-    allRows = cursorObj.fetchall()
+# Projects come back as sqlite3.Row: a tuple that also answers
+# project["Title"] (and project.Title in templates), at a fraction of the
+# memory of a dict per row. Rows are immutable, so cached ones are shared.
+# SQLite fills in the placeholder image and cuts the snippet, so no
+# per-row Python runs and long descriptions never reach Python at all
+_IMAGE_COLUMN = "COALESCE(NULLIF(ImageFileName, ''), 'placeholder.png') AS Image"
+# (checking for a character past the cut is cheaper than length(), which
+# counts every character of the text)
+_SNIPPET_COLUMN = (f"substr(Description, 1, {SNIPPET_LENGTH}) || "
+                   f"CASE WHEN substr(Description, {SNIPPET_LENGTH + 1}, 1) <> '' THEN '...' ELSE '' END "
+                   f"AS Description")
+LIST_COLUMNS = f"id, Title, {_SNIPPET_COLUMN}, {_IMAGE_COLUMN}"
+FULL_COLUMNS = f"id, Title, Description, {_IMAGE_COLUMN}"
 
-    projectListOfDictionaries = []
 
-    for individualRow in allRows:
-        # Make sure we have an image name
-        if individualRow[3] is not None and individualRow[3] != "":
-            Image = individualRow[3]
-        else:
-            Image = "placeholder.png"
-        # Create a dictionary for each row
-        p = {"id": individualRow[0], "Title": individualRow[1], "Description": individualRow[2], "Image": Image}
-        projectListOfDictionaries.append(p)
+#   THIS YIELDS ONE ROW AT A TIME
+@timed_query
+def iterProjects(after=None, limit=None, full_text=False):
+    """Yield projects in id order, starting after the project id ``after``.
+
+    ids are AUTOINCREMENT and CreatedDate defaults to the insert time, so id
+    order is also creation order and makes a stable keyset cursor. Bounded
+    pages (a ``limit`` is given) are served from the read-through cache.
+    Descriptions are cut to SNIPPET_LENGTH unless ``full_text`` is set.
+    """
+    # A. Unbounded iteration always streams straight from the database
+    if limit is None:
+        yield from _queryProjects(after, limit, full_text)
+        return
+
+    # B. Serve the page from the cache if we already have it
+    key = ("page", after or 0, limit, full_text)
+    found, cachedRows, generation = _cacheGet(key)
+    if found:
+        yield from cachedRows
+        return
+
+    # C. Otherwise stream it from the database, keeping a copy for next time
+    rows = []
+    for project in _queryProjects(after, limit, full_text):
+        rows.append(project)
+        yield project
+    _cachePut(key, rows, generation)
+
+
+def _queryProjects(after, limit, full_text=False):
+    # A. Keyset query: seek past the cursor instead of using OFFSET
+    columns = FULL_COLUMNS if full_text else LIST_COLUMNS
+    sql = f'SELECT {columns} FROM projects WHERE id > ? ORDER BY id'
+    params = [after or 0]
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    # B. Borrow a connection and stream the rows a batch at a time
+    with readConnection() as conn:
+        cursorObj = conn.cursor()
+        cursorObj.row_factory = sqlite3.Row
+        cursorObj.execute(sql, params)
+        while True:
+            rows = cursorObj.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+
+#   THIS RETURNS A LIST OF ROWS AND THE CURSOR FOR THE NEXT PAGE
+@timed_query
+def getProjectsPage(after=None, limit=PAGE_SIZE):
+    # A. Ask for one extra row so we know whether there is a next page
+    projectListOfDictionaries = list(iterProjects(after, limit + 1))
+
+    # B. The next page starts after the last project we actually return
+    nextAfter = None
+    if len(projectListOfDictionaries) > limit:
+        projectListOfDictionaries = projectListOfDictionaries[:limit]
+        nextAfter = projectListOfDictionaries[-1]["id"]
+
+    return projectListOfDictionaries, nextAfter
+
 
-    if conn:
-        conn.close()
+#   THIS RETURNS A LIST OF ROWS (WITH DESCRIPTION SNIPPETS)
+@timed_query
+def getAllProjects():
+    # A. Serve the cached full list if nothing has changed since it was read
+    found, cachedProjects, generation = _cacheGet(ALL_PROJECTS_KEY)
+    if found:
+        return list(cachedProjects)
+
+    # B. Otherwise read it and cache it
+    projectRows = list(iterProjects())
+    _cachePut(ALL_PROJECTS_KEY, projectRows, generation)
+    return list(projectRows)
 
-    return projectListOfDictionaries
+#   THIS RETURNS A NUMBER THAT CHANGES WHENEVER ANY PROJECT DOES
+@timed_query(rows=lambda version: 1)
+def getProjectsVersion():
+    """Return the projects change counter, e.g. to build an ETag from."""
+    # A. Served from the cache until the next write
+    found, cachedVersion, generation = _cacheGet(PROJECTS_VERSION_KEY)
+    if found:
+        return cachedVersion
+
+    # B. Otherwise read the trigger-maintained counter
+    with readConnection() as conn:
+        row = conn.execute("SELECT version FROM table_versions WHERE name = 'projects'").fetchone()
+    version = row[0] if row else 0
+    _cachePut(PROJECTS_VERSION_KEY, version, generation)
+    return version
 
 #######################################################
-# 3. CREATE DATABASE AND TABLE
+# 3. CREATE DATABASE AND TABLE (SCHEMA MIGRATIONS)
 #######################################################
+#   The schema is built by numbered migration steps. PRAGMA user_version
+#   records how many have been applied, so a current database costs one
+#   pragma read and only new steps ever run. Never edit a released step;
+#   append a new one.
+@timed_query
 def createDatabase():
-    # A. Make a connection to the database
-    conn = sqlite3.connect("projects.db")
-    
-    # B. Create a workspace (aka Cursor)
-    cur = conn.cursor()
-    
-    # C. Create the projects table
-    sql = '''CREATE TABLE IF NOT EXISTS projects (
+    """Bring the database schema up to date; returns the migrations applied."""
+    # A. The data directory may be a fresh volume
+    directory = os.path.dirname(DB_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # B. Apply whatever migrations are missing
+    applied = migrateDatabase()
+    if applied:
+        steps = ", ".join(f"{version} {name} ({seconds * 1000:.1f} ms)" for version, name, seconds in applied)
+        print(f"Database migrated to version {applied[-1][0]}: {steps}")
+    return applied
+
+
+def migrateDatabase():
+    """Apply pending migrations in order; returns [(version, name, seconds)] for each."""
+    applied = []
+    with getConnection() as conn:
+        # A. The common case: the schema is current, nothing else to do
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+            return applied
+
+        # B. Take the write lock and check again: another process (e.g. a
+        #    second gunicorn master) may have migrated in the meantime
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                started = time.perf_counter()
+                migration(conn)
+                seconds = time.perf_counter() - started
+                conn.execute("INSERT INTO schema_migrations (version, name, duration_ms) VALUES (?,?,?)",
+                             (version, migration.__name__, round(seconds * 1000, 3)))
+                # PRAGMA doesn't take parameters; version is always an int
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                applied.append((version, migration.__name__, seconds))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return applied
+
+
+def getSchemaVersion():
+    with getConnection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _createMigrationLog(conn):
+    # Which migration ran when, and how long it took
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        duration_ms REAL NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def _createProjectsTable(conn):
+    # IF NOT EXISTS: databases created before migrations already have it
+    conn.execute('''CREATE TABLE IF NOT EXISTS projects (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         Title TEXT NOT NULL,
         Description TEXT NOT NULL,
         ImageFileName TEXT,
         CreatedDate TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )'''
-    
-    # D. Execute the SQL statement
-    cur.execute(sql)
-    
-    # E. Save the changes
-    conn.commit()
-    
-    if conn:
-        conn.close()
-    
-    print("Database and table created successfully!")
+    )''')
+
+
+def _createContactsTable(conn):
+    # Passwords are only ever stored hashed
+    conn.execute('''CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        FirstName TEXT NOT NULL,
+        LastName TEXT NOT NULL,
+        Email TEXT NOT NULL,
+        PasswordHash TEXT NOT NULL,
+        Message TEXT,
+        CreatedDate TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def _createListingIndexes(conn):
+    # A. Newest-first and date-range listings walk this index instead of
+    #    sorting the whole table; id breaks ties within the same second
+    conn.execute("CREATE INDEX IF NOT EXISTS projects_created ON projects (CreatedDate, id)")
+
+    # B. Looking up a contact's submissions by address
+    conn.execute("CREATE INDEX IF NOT EXISTS contacts_email ON contacts (Email)")
+
+
+def _createChangeCounter(conn):
+    # A. One counter per table, bumped by every row written
+    conn.execute('''CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID''')
+    conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('projects', 0)")
+
+    # B. Triggers run inside the writing transaction, so the counter can
+    #    never disagree with the rows it describes
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS projects_version_{event.lower()} AFTER {event} ON projects BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'projects';
+        END''')
+
+
+def _createSearchIndex(conn):
+    # A. Is this the first time? Then existing rows need to be indexed
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='projects_fts'").fetchone()
+
+    # B. External-content FTS5 table: it stores only the index and reads
+    #    Title/Description back from the projects table
+    conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS projects_fts USING fts5(
+        Title, Description,
+        content='projects', content_rowid='id',
+        tokenize='porter unicode61'
+    )''')
+
+    # C. Triggers keep the index in step with every insert, update and delete
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS projects_fts_insert AFTER INSERT ON projects BEGIN
+        INSERT INTO projects_fts(rowid, Title, Description) VALUES (new.id, new.Title, new.Description);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS projects_fts_delete AFTER DELETE ON projects BEGIN
+        INSERT INTO projects_fts(projects_fts, rowid, Title, Description) VALUES ('delete', old.id, old.Title, old.Description);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS projects_fts_update AFTER UPDATE OF Title, Description ON projects BEGIN
+        INSERT INTO projects_fts(projects_fts, rowid, Title, Description) VALUES ('delete', old.id, old.Title, old.Description);
+        INSERT INTO projects_fts(rowid, Title, Description) VALUES (new.id, new.Title, new.Description);
+    END''')
+
+    # D. Backfill the index from the rows that are already there
+    if not exists:
+        conn.execute("INSERT INTO projects_fts(projects_fts) VALUES ('rebuild')")
+
+def _dropStaleStatistics(conn):
+    # A. Databases migrated before this step ran ANALYZE while they were
+    #    still empty. The planner kept trusting those row counts as the
+    #    tables grew, which made every FTS5 index write far slower (a
+    #    single-row insert at 60k rows: 1.18 ms instead of 0.09 ms)
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone():
+        conn.execute("DELETE FROM sqlite_stat1")
+
+    # B. Make this connection forget the statistics it already loaded
+    conn.execute("ANALYZE sqlite_schema")
+
+def _stripHighlightMarkers(conn):
+    # Rows saved before the write paths stripped the search markers
+    conn.execute('''UPDATE projects SET Title = replace(replace(Title, :start, ''), :end, ''),
+                                       Description = replace(replace(Description, :start, ''), :end, '')
+                    WHERE instr(Title, :start) OR instr(Title, :end)
+                       OR instr(Description, :start) OR instr(Description, :end)''',
+                 {"start": HIGHLIGHT_START, "end": HIGHLIGHT_END})
+
+# Applied in order; the position in this list (from 1) is the schema version
+MIGRATIONS = [
+    _createMigrationLog,
+    _createProjectsTable,
+    _createContactsTable,
+    _createSearchIndex,
+    _createListingIndexes,
+    _createChangeCounter,
+    _dropStaleStatistics,
+    _stripHighlightMarkers,
+]
 
 #######################################################
 # 4. GET PROJECT BY ID
 #######################################################
+@timed_query
 def getProjectById(project_id):
-    # A. Connection to the database
-    conn = sqlite3.connect('projects.db')
-    
-    # B. Create a workspace (aka Cursor)
-    cursorObj = conn.cursor()
-    
-    # C. Run the SQL Select statement to retrieve the data
-    cursorObj.execute('SELECT Title, Description, ImageFileName FROM projects WHERE id = ?', (project_id,))
-    
-    # D. Fetch the single record
-    row = cursorObj.fetchone()
-    
-    if row:
-        # Make sure we have an image name
-        if row[2] is not None and row[2] != "":
-            Image = row[2]
-        else:
-            Image = "placeholder.png"
-        # Create a dictionary for the row
-        project = {"Title": row[0], "Description": row[1], "Image": Image}
-    else:
-        project = None
-    
-    if conn:
-        conn.close()
-    
+    # A. Serve the project from the cache if we already have it
+    key = ("project", project_id)
+    found, cachedProject, generation = _cacheGet(key)
+    if found:
+        return cachedProject
+
+    # B. Borrow a connection and run the SQL Select statement; this is the
+    #    one read that loads the full Description
+    with readConnection() as conn:
+        cursorObj = conn.cursor()
+        cursorObj.row_factory = sqlite3.Row
+        cursorObj.execute(f'SELECT {FULL_COLUMNS} FROM projects WHERE id = ?', (project_id,))
+
+        # C. Fetch the single record (None if there is no such project)
+        project = cursorObj.fetchone()
+
+    # D. Cache misses too, so repeated lookups of a deleted id stay cheap
+    _cachePut(key, project, generation)
     return project
 
 #######################################################
 # 5. UPDATE PROJECT BY ID
 #######################################################
+@timed_query
 def updateProjectById(project_id, Title, Description, ImageFileName):
-    # A. Make a connection to the database
-    conn = sqlite3.connect("projects.db")
-    
-    # B. Create a workspace (aka Cursor)
-    cur = conn.cursor()
-    
-    # C. Write a SQL statement to update a specific row
+    """Update a project; returns False if there is no project with that id."""
+    return _queueUpdateProject(project_id, Title, Description, ImageFileName).result()
+
+
+def _queueUpdateProject(project_id, Title, Description, ImageFileName):
+    # A. Write a SQL statement to update a specific row
     sql = 'UPDATE projects SET Title = ?, Description = ?, ImageFileName = ? WHERE id = ?'
-    
-    # D. Run the SQL statement
-    cur.execute(sql, (Title, Description, ImageFileName, project_id))
-    
-    # E. Save the changes
-    conn.commit()
-    
-    if conn:
-        conn.close()
-    
-    return cur.rowcount > 0
+
+    # B. Queue it for the next group commit; the result says whether a row changed
+    return _groupCommit(sql, (_stripMarkers(Title), _stripMarkers(Description), ImageFileName, project_id),
+                        lambda cur: cur.rowcount > 0)
 
 #######################################################
 # 6. DELETE PROJECT BY ID
 #######################################################
+@timed_query
 def deleteProjectById(project_id):
-    # A. Make a connection to the database
-    conn = sqlite3.connect("projects.db")
-    
-    # B. Create a workspace (aka Cursor)
-    cur = conn.cursor()
-    
-    # C. Write a SQL statement to delete a specific row
+    """Delete a project; returns False if there is no project with that id."""
+    return _queueDeleteProject(project_id).result()
+
+
+def _queueDeleteProject(project_id):
+    # A. Write a SQL statement to delete a specific row
     sql = 'DELETE FROM projects WHERE id = ?'
-    
-    # D. Run the SQL statement
-    cur.execute(sql, (project_id,))
-    
-    # E. Save the changes
-    conn.commit()
-    
-    if conn:
-        conn.close()
-    
-    return cur.rowcount > 0
+
+    # B. Queue it for the next group commit; the result says whether a row went
+    return _groupCommit(sql, (project_id,), lambda cur: cur.rowcount > 0)
+
+#######################################################
+# 7. BULK IMPORT
+#######################################################
+# Rows written per transaction; keeps the WAL and lock hold time bounded
+BULK_CHUNK_SIZE = 5000
+
+
+@timed_query
+def bulkSaveProjects(rows, chunk_size=BULK_CHUNK_SIZE):
+    """Insert (Title, Description, ImageFileName) tuples, committing once per chunk.
+
+    ``rows`` can be any iterable, including a generator reading a file, so
+    the whole import never has to be held in memory. Returns the number of
+    rows inserted.
+    """
+    # A. Same statement as saveProjectDB, run with executemany
+    sql = 'INSERT INTO projects (Title, Description, ImageFileName) values (?,?,?)'
+    total = 0
+
+    # B. One connection for the whole import, one transaction per chunk
+    _checkpointer()
+    try:
+        with getConnection() as conn:
+            chunk = []
+            for title, description, image in rows:
+                chunk.append((_stripMarkers(title), _stripMarkers(description), image))
+                if len(chunk) >= chunk_size:
+                    with conn:
+                        conn.executemany(sql, chunk)
+                    total += len(chunk)
+                    chunk = []
+            if chunk:
+                with conn:
+                    conn.executemany(sql, chunk)
+                total += len(chunk)
+    finally:
+        # C. Anything cached from before the import is now out of date,
+        #    even if a later chunk failed after earlier ones committed
+        invalidateCache()
+
+    return total
+
+#######################################################
+# 8. FULL-TEXT SEARCH
+#######################################################
+# Matched terms come back wrapped in these control characters. Nothing
+# stops a form post or an import from containing them, so every write path
+# strips them from Title and Description (_stripMarkers); only then can the
+# view escape the text and swap the markers for <mark> tags safely
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+
+
+def _stripMarkers(text):
+    if text is None:
+        return None
+    return text.replace(HIGHLIGHT_START, "").replace(HIGHLIGHT_END, "")
+
+
+# Title matches count for more than Description matches
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_TERMS = 10
+
+
+def _ftsQuery(text):
+    # Quote every word so FTS5 operators in user input are treated as text,
+    # and prefix-match it so "analy" finds "analytics"
+    terms = re.findall(r"\w+", text or "")[:MAX_SEARCH_TERMS]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+#   THIS RETURNS A LIST OF DICTIONARIES, BEST MATCH FIRST
+@timed_query
+def searchProjects(query, limit=SEARCH_LIMIT):
+    # A. Turn the search box text into an FTS5 query
+    match = _ftsQuery(query)
+    if not match:
+        return []
+
+    # B. Rank with bm25 and mark the matching terms
+    sql = f'''SELECT p.id,
+                    highlight(projects_fts, 0, ?, ?) AS Title,
+                    snippet(projects_fts, 1, ?, ?, '...', 32) AS Description,
+                    {_IMAGE_COLUMN}
+             FROM projects_fts
+             JOIN projects p ON p.id = projects_fts.rowid
+             WHERE projects_fts MATCH ?
+             ORDER BY bm25(projects_fts, ?, ?)
+             LIMIT ?'''
+    params = (HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END,
+              match, TITLE_WEIGHT, DESCRIPTION_WEIGHT, limit)
+
+    with readConnection() as conn:
+        cursorObj = conn.cursor()
+        cursorObj.row_factory = sqlite3.Row
+        return cursorObj.execute(sql, params).fetchall()
+
+#######################################################
+# 9. READ-THROUGH CACHE
+#######################################################
+#   Single projects and table pages live in a bounded LRU, the full list
+#   under its own key. Every write in this process bumps the generation,
+#   and PRAGMA data_version tells us when another worker process has
+#   committed to the same file, so no worker ever serves stale rows.
+#   Entries are bounded by count and by the rows they hold together: a
+#   page can hold MAX_PAGE_SIZE + 1 rows, so a client walking ?after= and
+#   ?limit= values could otherwise fill memory with 1024 large pages.
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_ROWS = 20000
+ALL_PROJECTS_KEY = ("all",)
+PROJECTS_VERSION_KEY = ("version",)
+
+_cache = OrderedDict()
+_cacheLock = threading.Lock()
+_cacheStats = {"hits": 0, "misses": 0, "invalidations": 0}
+_cacheGeneration = 0
+_cacheWatcher = None
+_cacheDataVersion = None
+_cacheCheckedAt = 0.0
+_cacheRows = 0
+
+
+def _rowCount(value):
+    # Lists of rows count each row; a single row, None or a number counts one
+    return len(value) if isinstance(value, list) else 1
+
+
+def _checkForExternalChanges():
+    # Called with _cacheLock held.
+    global _cacheWatcher, _cacheDataVersion, _cacheCheckedAt
+
+    # A. With snapshot reads (section 13) the file is only looked at every
+    #    SNAPSHOT_MAX_STALENESS seconds; otherwise on every read
+    if _snapshotReads and time.monotonic() - _cacheCheckedAt < SNAPSHOT_MAX_STALENESS:
+        return
+    _cacheCheckedAt = time.monotonic()
+
+    # B. A dedicated connection: data_version changes whenever any *other*
+    #    connection (pooled or in another process) commits to the file
+    if _cacheWatcher is None:
+        _cacheWatcher = _openConnection()
+
+    dataVersion = _cacheWatcher.execute("PRAGMA data_version").fetchone()[0]
+
+    # C. Drop everything if the file changed since we last looked
+    if dataVersion != _cacheDataVersion:
+        if _cacheDataVersion is not None:
+            _clearCache()
+        _cacheDataVersion = dataVersion
+
+
+def _clearCache():
+    # Called with _cacheLock held.
+    global _cacheGeneration, _cacheRows
+    _cacheGeneration += 1
+    _cache.clear()
+    _cacheRows = 0
+    _cacheStats["invalidations"] += 1
+
+
+def _cacheGet(key):
+    """Return (found, value, generation) for a cache key."""
+    with _cacheLock:
+        _checkForExternalChanges()
+        if key in _cache:
+            _cache.move_to_end(key)
+            _cacheStats["hits"] += 1
+            return True, _cache[key][0], _cacheGeneration
+        _cacheStats["misses"] += 1
+        return False, None, _cacheGeneration
+
+
+def _cachePut(key, value, generation):
+    global _cacheRows
+    with _cacheLock:
+        # A. A write happened while we were reading, so the value may be
+        #    stale, and a value bigger than the whole budget isn't kept
+        rows = _rowCount(value)
+        if generation != _cacheGeneration or rows > CACHE_MAX_ROWS:
+            return
+
+        # B. Store it, evicting least recently used entries until both
+        #    limits hold
+        if key in _cache:
+            _cacheRows -= _cache[key][1]
+        _cache[key] = (value, rows)
+        _cache.move_to_end(key)
+        _cacheRows += rows
+        while len(_cache) > CACHE_MAX_ENTRIES or _cacheRows > CACHE_MAX_ROWS:
+            _cacheRows -= _cache.popitem(last=False)[1][1]
+
+
+def invalidateCache():
+    """Forget every cached read; called by each write path after it commits."""
+    global _cacheDataVersion
+    with _cacheLock:
+        _clearCache()
+        # Our own commit moved data_version as well, and this clear already
+        # covers it: don't clear again (or copy the snapshot again) for it
+        if _cacheWatcher is not None:
+            _cacheDataVersion = _cacheWatcher.execute("PRAGMA data_version").fetchone()[0]
+
+
+def resetCache():
+    """Empty the cache and close its watcher connection."""
+    global _cacheWatcher, _cacheDataVersion, _cacheCheckedAt
+    with _cacheLock:
+        _clearCache()
+        if _cacheWatcher is not None:
+            _cacheWatcher.close()
+        _cacheWatcher = None
+        _cacheDataVersion = None
+        _cacheCheckedAt = 0.0
+
+
+def getCacheStats():
+    """Return the cache hit/miss counters and its current size."""
+    with _cacheLock:
+        stats = dict(_cacheStats)
+        stats["entries"] = len(_cache)
+        stats["rows"] = _cacheRows
+        stats["generation"] = _cacheGeneration
+    return stats
+
+
+def _cacheSamples():
+    stats = getCacheStats()
+    return [
+        ("dal_cache_hits_total", "counter", "Read-through cache hits.", (), stats["hits"]),
+        ("dal_cache_misses_total", "counter", "Read-through cache misses.", (), stats["misses"]),
+        ("dal_cache_invalidations_total", "counter", "Times the cache was emptied by a write.", (), stats["invalidations"]),
+        ("dal_cache_entries", "gauge", "Entries currently cached.", (), stats["entries"]),
+    ]
+
+
+registry.add_collector(_cacheSamples)
+
+#######################################################
+# 10. ASYNC DAL
+#######################################################
+#   Awaitable versions of the functions above for code running on an event
+#   loop (an ASGI server, scripts). Reads run the sync function on a bounded
+#   thread pool sized to leave the writer a connection. Writes await the
+#   group-commit queue (section 11), whose single writer thread commits them
+#   in order instead of contending for SQLite's write lock.
+#
+#   The Flask views don't use them: under WSGI Flask runs an async view
+#   through asgiref's async_to_sync, which blocks the request thread until
+#   the view is done, so the hop to these pools only added overhead.
+ASYNC_READ_WORKERS = POOL_SIZE - 1
+
+_readExecutor = None
+_executorPid = None
+_executorLock = threading.Lock()
+
+
+def _executor():
+    global _readExecutor, _executorPid
+
+    # Threads don't survive a fork, so each worker process starts its own pool
+    with _executorLock:
+        if _executorPid != os.getpid():
+            _readExecutor = ThreadPoolExecutor(max_workers=ASYNC_READ_WORKERS, thread_name_prefix="dal-reader")
+            _executorPid = os.getpid()
+        return _readExecutor
+
+
+async def _read(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor(), functools.partial(function, *args))
+
+
+async def getProjectsPageAsync(after=None, limit=PAGE_SIZE):
+    return await _read(getProjectsPage, after, limit)
+
+
+async def getAllProjectsAsync():
+    return await _read(getAllProjects)
+
+
+async def getProjectByIdAsync(project_id):
+    return await _read(getProjectById, project_id)
+
+
+async def searchProjectsAsync(query, limit=SEARCH_LIMIT):
+    return await _read(searchProjects, query, limit)
+
+
+async def saveProjectDBAsync(Title, Description, ImageFileName):
+    return await asyncio.wrap_future(_queueSaveProject(Title, Description, ImageFileName))
+
+
+async def updateProjectByIdAsync(project_id, Title, Description, ImageFileName):
+    return await asyncio.wrap_future(_queueUpdateProject(project_id, Title, Description, ImageFileName))
+
+
+async def deleteProjectByIdAsync(project_id):
+    return await asyncio.wrap_future(_queueDeleteProject(project_id))
+
+#######################################################
+# 11. GROUP COMMIT
+#######################################################
+#   Single-row writes are queued for one writer thread. It takes whatever
+#   is waiting (and, under concurrent load, whatever arrives within
+#   GROUP_COMMIT_WINDOW) and commits the lot in a single transaction, so
+#   a burst of edits costs one lock acquisition and one commit instead of
+#   one each. Every write runs in its own savepoint: one that fails is
+#   rolled back and reported to its caller without undoing the others.
+GROUP_COMMIT_WINDOW = 0.002
+GROUP_COMMIT_MAX_WRITES = 64
+
+_writeQueue = None
+_writerPid = None
+_writerLock = threading.Lock()
+
+
+def _groupCommit(sql, params, result):
+    """Queue one write; the Future resolves to ``result(cursor)`` once it is committed."""
+    future = Future()
+    _writer().put((sql, params, result, future))
+    return future
+
+
+def getPendingWrites():
+    """How many queued writes are waiting for the writer thread in this process."""
+    if _writerPid != os.getpid():
+        return 0
+    return _writeQueue.qsize()
+
+
+def _writer():
+    global _writeQueue, _writerPid
+
+    # Like the read pool, each process (and each forked worker) needs its own thread
+    with _writerLock:
+        if _writerPid != os.getpid():
+            _checkpointer()
+            _writeQueue = queue.Queue()
+            threading.Thread(target=_writerLoop, args=(_writeQueue,),
+                             name="dal-writer", daemon=True).start()
+            _writerPid = os.getpid()
+        return _writeQueue
+
+
+def _writerLoop(writes):
+    while True:
+        # A. Block for the first write and take everything queued behind it.
+        #    A lone write is committed straight away; if others were already
+        #    waiting, writes are arriving concurrently, so linger up to the
+        #    window for more of them
+        group = [writes.get()]
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+        while len(group) < GROUP_COMMIT_MAX_WRITES:
+            remaining = deadline - time.monotonic()
+            try:
+                if len(group) > 1 and remaining > 0:
+                    group.append(writes.get(timeout=remaining))
+                else:
+                    group.append(writes.get_nowait())
+            except queue.Empty:
+                break
+
+        # B. Commit them together. Whatever goes wrong, fail the writes
+        #    instead of the thread: every later write would hang without it
+        try:
+            _commitGroup(group)
+        except Exception as e:
+            for _, _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+
+
+def _commitGroup(group):
+    # A write whose caller gave up (e.g. a cancelled await) is skipped; the
+    # rest can no longer be cancelled, so answering them can't fail
+    group = [write for write in group if write[3].set_running_or_notify_cancel()]
+    if not group:
+        return
+
+    outcomes = []
+    try:
+        with getConnection() as conn:
+            # A. Take the write lock up front instead of upgrading mid-group
+            conn.execute("BEGIN IMMEDIATE")
+
+            # B. Run each write in a savepoint and remember its result or error
+            for sql, params, result, future in group:
+                conn.execute("SAVEPOINT groupWrite")
+                try:
+                    outcomes.append((future, result(conn.execute(sql, params)), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO groupWrite")
+                    outcomes.append((future, None, e))
+                conn.execute("RELEASE groupWrite")
+
+            # C. One commit for the whole group
+            conn.commit()
+    except Exception as e:
+        # Nothing in the group was committed
+        for _, _, _, future in group:
+            future.set_exception(e)
+        return
+
+    # D. Invalidate before answering, so every caller reads its own write
+    invalidateCache()
+    for future, value, error in outcomes:
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+registry.add_collector(lambda: [("dal_pending_writes", "gauge", "Writes queued for the group-commit writer.",
+                                  (), getPendingWrites())])
+
+#######################################################
+# 12. CONTACT SUBMISSIONS
+#######################################################
+@timed_query
+def saveContacts(rows):
+    """Insert (FirstName, LastName, Email, PasswordHash, Message) tuples in one transaction.
+
+    Returns how many were written.
+    """
+    # A. Write a SQL statement to insert one contact
+    sql = 'INSERT INTO contacts (FirstName, LastName, Email, PasswordHash, Message) values (?,?,?,?,?)'
+
+    # B. Insert the whole batch with one commit
+    rows = list(rows)
+    _checkpointer()
+    with getConnection() as conn:
+        with conn:
+            conn.executemany(sql, rows)
+    return len(rows)
+
+
+#   THIS RETURNS A LIST OF DICTIONARIES, NEWEST FIRST (WITHOUT THE PASSWORD HASH)
+@timed_query
+def getAllContacts():
+    sql = 'SELECT id, FirstName, LastName, Email, Message, CreatedDate FROM contacts ORDER BY id DESC'
+    with getConnection() as conn:
+        rows = conn.execute(sql).fetchall()
+    return [{"id": row[0], "FirstName": row[1], "LastName": row[2], "Email": row[3],
+             "Message": row[4], "CreatedDate": row[5]} for row in rows]
+
+
+def getContactPasswordHash(contact_id):
+    """Return the stored password hash of one contact, or None."""
+    with getConnection() as conn:
+        row = conn.execute('SELECT PasswordHash FROM contacts WHERE id = ?', (contact_id,)).fetchone()
+    return row[0] if row else None
+
+#######################################################
+# 13. IN-MEMORY READ SNAPSHOT
+#######################################################
+#   Optional (enableSnapshotReads): each worker process keeps a private
+#   in-memory copy of the database, taken with the sqlite3 backup API, and
+#   the project reads above query it instead of the file, so they never
+#   touch the disk or contend with a writer. The copy belongs to one cache
+#   generation: a commit in this process retires it at once, and the next
+#   read takes a fresh copy and swaps it in whole. Commits by other
+#   processes are noticed through PRAGMA data_version at most
+#   SNAPSHOT_MAX_STALENESS seconds late. A reader still iterating a retired
+#   copy finishes on it. Contacts are always read from the file.
+#
+#   One connection serves every reader thread, which relies on SQLite being
+#   built serialized (sqlite3.threadsafety == 3, the default).
+SNAPSHOT_MAX_STALENESS = 1.0
+
+_snapshotReads = False
+_snapshot = None  # (connection, cache generation, pid)
+_snapshotLock = threading.Lock()
+_snapshotStats = {"refreshes": 0}
+
+
+def enableSnapshotReads(max_staleness=SNAPSHOT_MAX_STALENESS):
+    """Serve project reads from an in-memory copy that may lag other processes by ``max_staleness`` seconds."""
+    global _snapshotReads, SNAPSHOT_MAX_STALENESS
+    SNAPSHOT_MAX_STALENESS = max_staleness
+    _snapshotReads = True
+
+
+def disableSnapshotReads():
+    """Go back to reading from the file."""
+    global _snapshotReads
+    _snapshotReads = False
+    _dropSnapshot()
+
+
+@contextmanager
+def readConnection():
+    """Borrow a connection for reading: the snapshot when enabled, otherwise a pooled one."""
+    if _snapshotReads:
+        yield _currentSnapshot()
+        return
+    with getConnection() as conn:
+        yield conn
+
+
+def _currentSnapshot():
+    global _snapshot
+
+    # A. Use the current copy if nothing was committed since it was taken
+    with _cacheLock:
+        _checkForExternalChanges()
+        generation = _cacheGeneration
+    snapshot = _snapshot
+    if snapshot is not None and snapshot[1] >= generation and snapshot[2] == os.getpid():
+        return snapshot[0]
+
+    # B. Otherwise one thread takes a new copy while the others wait for it.
+    #    It is labelled with the generation read before copying, so a commit
+    #    landing during the copy retires it again
+    with _snapshotLock:
+        snapshot = _snapshot
+        if snapshot is None or snapshot[1] < generation or snapshot[2] != os.getpid():
+            with _cacheLock:
+                generation = _cacheGeneration
+            snapshot = _snapshot = (takeSnapshot(), generation, os.getpid())
+    return snapshot[0]
+
+
+def _dropSnapshot():
+    global _snapshot
+    with _snapshotLock:
+        _snapshot = None
+
+
+@timed_query(rows=lambda conn: 1)
+def takeSnapshot():
+    """Copy the database into a new read-only in-memory connection."""
+    # A. The backup runs in one step, inside a single read transaction of
+    #    the source, so the copy is consistent
+    memory = sqlite3.connect(":memory:", check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE,
+                             factory=TimedConnection)
+    with getConnection() as source:
+        source.backup(memory)
+
+    # B. Nothing may write to the copy
+    memory.execute("PRAGMA query_only=ON")
+    _snapshotStats["refreshes"] += 1
+    return memory
+
+
+def _snapshotSamples():
+    return [("dal_snapshot_refreshes_total", "counter",
+             "In-memory snapshots taken of the database.", (), _snapshotStats["refreshes"])]
+
+
+registry.add_collector(_snapshotSamples)
+
+#######################################################
+# 14. WAL CHECKPOINTS
+#######################################################
+#   wal_autocheckpoint only runs when a commit crosses the threshold, on
+#   whichever request made it, and a checkpoint can't finish while readers
+#   still use old pages. A background thread per process also checkpoints
+#   every CHECKPOINT_INTERVAL seconds (PASSIVE: it never blocks readers or
+#   writers), so the WAL is folded back between bursts and, with
+#   journal_size_limit, stays bounded under sustained writes. It is started
+#   by the first write a process queues, not when it connects: gunicorn's
+#   master connects to migrate and warm up, and must fork without threads.
+_checkpointerPid = None
+_checkpointerLock = threading.Lock()
+
+
+@timed_query(rows=lambda result: result[2])
+def checkpointDatabase(mode="PASSIVE"):
+    """Run a WAL checkpoint; returns (busy, WAL frames, frames checkpointed)."""
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+    with getConnection() as conn:
+        return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+
+def _checkpointer():
+    global _checkpointerPid
+
+    # Like the writer, each process (and each forked worker) needs its own thread
+    with _checkpointerLock:
+        if _checkpointerPid != os.getpid() and CHECKPOINT_INTERVAL > 0:
+            _checkpointerPid = os.getpid()
+            threading.Thread(target=_checkpointLoop, name="dal-checkpointer", daemon=True).start()
+
+
+def _checkpointLoop():
+    while True:
+        time.sleep(CHECKPOINT_INTERVAL)
+        # Don't create the file if it went away (e.g. a test database)
+        if not os.path.exists(DB_PATH):
+            continue
+        try:
+            checkpointDatabase()
+        except sqlite3.Error as e:
+            print(f"WAL checkpoint failed: {e}")
+
+#######################################################
+# 15. SLOW QUERY LOG
+#######################################################
+#   Every connection the DAL opens hands out TimedCursors. A statement's
+#   time is its execute plus the fetches that read its rows; once it is
+#   done (no rows to return, the rows ran out, or a single-row fetch), one
+#   that took SLOW_QUERY_MS or longer is printed and kept in a short
+#   history with its parameter shape (types and sizes, never the values)
+#   and its EXPLAIN QUERY PLAN. For executemany, both come from the first
+#   parameter row.
+SLOW_QUERY_MS = _envNumber("DB_SLOW_QUERY_MS", 100.0, float)  # 0 turns the log off
+SLOW_QUERY_HISTORY = 100
+
+_slowQueries = deque(maxlen=SLOW_QUERY_HISTORY)
+registry.describe("dal_slow_queries_total", "counter", "Statements slower than the slow-query threshold.")
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that reports its statements to the slow-query log."""
+
+    _statement = None  # [sql, parameters, seconds so far, executemany?]
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._statement = [sql, parameters, time.perf_counter() - start, False]
+        # Statements without rows (writes, DDL) are done already
+        if self.description is None:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        # Keep the first row for the plan; rows may come from a generator
+        rows = iter(seq_of_parameters)
+        first = next(rows, None)
+        if first is not None:
+            rows = itertools.chain((first,), rows)
+        start = time.perf_counter()
+        super().executemany(sql, rows)
+        self._statement = [sql, first, time.perf_counter() - start, True]
+        self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._statement is not None:
+                self._statement[2] += time.perf_counter() - start
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        if statement is not None and 0 < SLOW_QUERY_MS <= statement[2] * 1000:
+            _logSlowQuery(self.connection, *statement)
+
+
+class TimedConnection(sqlite3.Connection):
+    """A connection whose cursors (and execute shortcuts) are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # The C shortcuts don't go through cursor(), so route them explicitly
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _parameterShape(parameters):
+    # Types and sizes only: parameters can hold personal data or password hashes
+    if parameters is None:
+        return []
+    if isinstance(parameters, dict):
+        return {key: _valueShape(value) for key, value in parameters.items()}
+    return [_valueShape(value) for value in parameters]
+
+
+def _valueShape(value):
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def _logSlowQuery(conn, sql, parameters, seconds, many=False):
+    # A. Ask SQLite how it ran the statement (an executemany of no rows has
+    #    nothing to bind). A plain cursor, so this isn't timed itself
+    try:
+        rows = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}",
+                                            () if parameters is None else parameters).fetchall()
+        plan = [row[3] for row in rows]
+    except sqlite3.Error:
+        plan = []
+
+    # B. Keep it and print it
+    entry = {"sql": " ".join(sql.split()), "parameters": _parameterShape(parameters), "executemany": many,
+             "ms": round(seconds * 1000, 3), "plan": plan, "at": time.time()}
+    _slowQueries.append(entry)
+    registry.inc("dal_slow_queries_total")
+    print(f"Slow query ({entry['ms']:.1f} ms): {entry['sql']} "
+          f"{'executemany, first ' if many else ''}parameters={entry['parameters']} "
+          f"plan={' / '.join(plan) or '-'}")
+
+
+def getSlowQueries():
+    """Return the most recent slow queries, oldest first."""
+    return list(_slowQueries)
@@ -1,69 +1,377 @@
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash
+import time
+# Startup report: how long importing this module took
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, render_template, stream_template, stream_with_context, request, redirect, url_for, flash, get_flashed_messages, abort, jsonify
+import atexit
+import json
+from jinja2 import FileSystemBytecodeCache
 import os
-from DAL import getAllProjects, saveProjectDB, getProjectById, updateProjectById, deleteProjectById
+from markupsafe import Markup, escape
+from page_cache import PageCache
+from file_server import FileIndex, send_indexed_file
+from images import ImageVariants
+from compression import Compress, available_encodings
+import bulk_io
+from metrics import RequestMetrics, registry
+from contacts import ContactQueue, ContactQueueFull
+from edge_cache import EdgeCache
+from uploads import UPLOADS_DIRNAME, ImageUploads, UploadRejected
+from rate_limit import RateLimiter
+from profiling import RequestProfiler
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.exceptions import RequestEntityTooLarge
+from DAL import createDatabase, enableSnapshotReads, getPendingWrites, iterProjects, getProjectsVersion, searchProjects, HIGHLIGHT_START, HIGHLIGHT_END, saveProjectDB, getProjectById, updateProjectById, deleteProjectById, closeAllConnections, PAGE_SIZE, MAX_PAGE_SIZE
 
 # Initialize Flask app with templates and static folders
-app = Flask(__name__, 
+app = Flask(__name__,
             template_folder='templates',
             static_folder='static')
 
 # Set secret key for flash messages
 app.secret_key = 'your-secret-key-here'
 
+# Compiled templates are kept on disk and shared by every worker, so a
+# restarted or recycled worker loads them instead of compiling them again
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(app.root_path, '.jinja_cache'))
+
+def template_bytecode_cache(directory):
+    # Without a writable directory templates are simply compiled in memory
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(directory, os.W_OK):
+        return None
+    return FileSystemBytecodeCache(directory)
+
+app.jinja_env.bytecode_cache = template_bytecode_cache(TEMPLATE_CACHE_DIR)
+
+# Behind nginx, file routes answer with X-Accel-Redirect and nginx sends the
+# bytes (only for requests nginx marks with X-Sendfile-Type, see nginx.conf)
+app.config['USE_X_ACCEL_REDIRECT'] = os.environ.get('USE_X_ACCEL_REDIRECT', '1').lower() in ('1', 'true', 'yes')
+
+# nginx's internal refresh listener, used to purge its micro-cache after writes
+app.config['EDGE_PURGE_URL'] = os.environ.get('EDGE_PURGE_URL')
+
+# Largest image accepted by the add/edit project forms, in bytes
+app.config['MAX_IMAGE_UPLOAD_SIZE'] = int(os.environ.get('MAX_IMAGE_UPLOAD_SIZE', 10 * 1024 * 1024))
+
+# Optionally serve project reads from a per-worker in-memory copy of the
+# database, which may lag writes made by other workers by up to
+# DB_SNAPSHOT_MAX_STALENESS seconds (writes in the same worker show at once)
+if os.environ.get('DB_SNAPSHOT_READS', '0').lower() in ('1', 'true', 'yes'):
+    enableSnapshotReads(float(os.environ.get('DB_SNAPSHOT_MAX_STALENESS', '1.0')))
+
+# How many proxies (nginx) sit in front of the app. Their X-Forwarded-For /
+# X-Forwarded-Proto are trusted for that many hops, so request.remote_addr
+# is the real client; with 0 the headers are ignored and can't be spoofed
+app.config['PROXY_HOPS'] = int(os.environ.get('PROXY_HOPS', '0'))
+if app.config['PROXY_HOPS']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_HOPS'], x_proto=app.config['PROXY_HOPS'])
+
+# Per-client limits on the write routes; while more than this many writes
+# wait for the DAL writer, new ones are turned away with a 503
+app.config['RATE_LIMITS_ENABLED'] = os.environ.get('RATE_LIMITS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+app.config['MAX_PENDING_WRITES'] = int(os.environ.get('MAX_PENDING_WRITES', '256'))
+
+# cProfile a fraction of requests, or any request sent with
+# X-Profile: <PROFILE_TOKEN>; files go to PROFILE_DIR/<endpoint>/
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN') or None
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.root_path, 'profiles'))
+
+# Close the pooled database connections when the app shuts down
+atexit.register(closeAllConnections)
+
+# Contact submissions are hashed and saved in the background; whatever is
+# still queued at shutdown is saved before the connections close
+contact_queue = ContactQueue()
+atexit.register(contact_queue.close)
+
+# Pages that only change between deploys are rendered once and served from memory
+page_cache = PageCache(app)
+
+# Metadata/ETag indexes for the files behind /static, /images and /resume.pdf.
+# Static assets and the resume also get precompressed .br/.gz siblings
+static_index = FileIndex(app.static_folder, encodings=available_encodings(),
+                         accel_prefix='/_accel/static')
+images_index = FileIndex(os.path.join(app.root_path, 'static', 'images'),
+                         accel_prefix='/_accel/images')
+resume_index = FileIndex(app.root_path, encodings=available_encodings(),
+                         accel_prefix='/_accel/resume')
+
+# Gzip HTML and other text responses on the fly when the client accepts it
+Compress(app)
+
+# Request counts and latency histograms per endpoint, served at /metrics
+RequestMetrics(app)
+
+# On-demand profiles of single requests (see profiling.py)
+RequestProfiler(app)
+
+# Project pages are micro-cached by nginx under the "projects" surrogate key
+# and refreshed whenever a project write succeeds
+edge_cache = EdgeCache(app)
+
+# Token buckets per client IP for the POST routes (see rate_limit.py)
+rate_limiter = RateLimiter(app)
+
+def writes_backed_up():
+    return getPendingWrites() >= app.config['MAX_PENDING_WRITES']
+
+def contacts_backed_up():
+    return contact_queue.pending() >= contact_queue.max_size
+
+# Resized, content-hashed variants of the images, used for srcset in templates
+image_variants = ImageVariants(images_index.directory)
+app.jinja_env.globals['image_srcset'] = image_variants.srcset
+
+# Images uploaded with the project forms, streamed to static/images/uploads
+# and named by their content hash
+image_uploads = ImageUploads(os.path.join(images_index.directory, 'uploads'), app)
+
+# Serve Flask's /static/<filename> route from the file index as well
+def serve_static(filename):
+    return send_indexed_file(static_index, filename)
+
+app.view_functions['static'] = serve_static
+
 # Route to serve images from the static/images directory
 @app.route('/images/<path:filename>')
 def serve_image(filename):
-    return send_from_directory('static/images', filename)
+    # ?w=<px> serves the smallest generated variant at least that wide
+    width = request.args.get('w', type=int)
+    if width:
+        accept_webp = request.accept_mimetypes['image/webp'] > 0
+        variant = image_variants.best(filename, width, accept_webp)
+        response = send_indexed_file(images_index, variant or filename, immutable=False)
+        response.vary.add('Accept')
+        return response
+    return send_indexed_file(images_index, filename)
 
 # Route to serve resume PDF
 @app.route('/resume.pdf')
 def serve_resume():
-    return send_from_directory('.', 'resume.pdf')
+    return send_indexed_file(resume_index, 'resume.pdf')
+
+# Cheap liveness check for Docker/nginx: no template, no database
+@app.route('/healthz')
+def healthz():
+    return 'ok', 200, {'Content-Type': 'text/plain', 'Cache-Control': 'no-store'}
+
+# Prometheus scrape endpoint
+@app.route('/metrics')
+def metrics():
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4', 'Cache-Control': 'no-store'}
 
 # Route for the homepage
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return page_cache.page('index.html')
 
 # Route for about page
 @app.route('/about')
 def about():
-    return render_template('about.html')
+    return page_cache.page('about.html')
 
 # Route for resume page
 @app.route('/resume')
 def resume():
-    return render_template('resume.html')
+    return page_cache.page('resume.html')
 
 # Route for projects page
 @app.route('/projects')
+@edge_cache.cached('projects')
 def projects():
-    # Get all projects from the database
-    projects_list = getAllProjects()
-    return render_template('projects.html', projects=projects_list)
+    # Keyset pagination: ?after=<last id seen>&limit=<rows per page>
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    if limit < 1:
+        limit = PAGE_SIZE
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    # Read the flash messages before streaming starts; the session cookie
+    # is written with the headers, before the template body is generated
+    get_flashed_messages(with_categories=True)
+
+    page = {"after": after, "limit": limit, "next_after": None}
+
+    def page_rows():
+        # Fetch one extra row to find out whether there is a next page
+        # (and run the generator to the end so the page gets cached)
+        last_id = None
+        for index, project in enumerate(iterProjects(after, limit + 1)):
+            if index == limit:
+                page["next_after"] = last_id
+            else:
+                last_id = project["id"]
+                yield project
+
+    # Stream the page so the header goes out before the rows are fetched
+    return stream_template('projects.html', projects=page_rows(), page=page)
+
+# Route for searching projects
+@app.route('/projects/search')
+@edge_cache.cached('projects')
+def search_projects():
+    query = request.args.get('q', '').strip()
+    results = searchProjects(query) if query else []
+    return render_template('search.html', query=query, results=results)
+
+# Escape search results, then turn the DAL's match markers into <mark> tags
+@app.template_filter('highlight')
+def highlight(text):
+    return escape(text).replace(HIGHLIGHT_START, Markup('<mark>')).replace(HIGHLIGHT_END, Markup('</mark>'))
+
+# Route for exporting every project as CSV or NDJSON, streamed row by row
+@app.route('/projects/export.<fmt>')
+def export_projects(fmt):
+    if fmt not in bulk_io.FORMATS:
+        abort(404)
+    response = app.response_class(stream_with_context(bulk_io.export_projects(fmt)),
+                                  mimetype=bulk_io.MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=projects.{fmt}'
+    return response
+
+# Route for importing projects from an uploaded CSV/NDJSON file or a raw body
+@app.route('/projects/import', methods=['POST'])
+@edge_cache.purges('projects')
+@rate_limiter.limit(per_minute=2, burst=2, overloaded=writes_backed_up)
+def import_projects():
+    upload = request.files.get('file')
+    if upload:
+        fmt = request.form.get('format') or bulk_io.guess_format(upload.filename, upload.mimetype)
+        stream = upload.stream
+    else:
+        fmt = request.args.get('format') or bulk_io.guess_format(mimetype=request.mimetype)
+        stream = request.stream
+    if fmt not in bulk_io.FORMATS:
+        return jsonify(error='Send a .csv or .ndjson file, or pass format=csv|ndjson.'), 400
+
+    try:
+        count = bulk_io.import_projects(bulk_io.text_reader(stream), fmt)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(imported=count)
+
+# JSON API. Every response carries an ETag made from the projects change
+# counter, so a client holding the current one gets a 304 before any row is
+# queried or serialized. The counter is read before the rows: a write in
+# between can only make the ETag older than the body, never newer
+def api_etag():
+    return f'projects-{getProjectsVersion()}'
+
+def api_not_modified(etag):
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/projects')
+@edge_cache.cached('projects')
+def api_projects():
+    etag = api_etag()
+    not_modified = api_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    if limit < 1:
+        limit = PAGE_SIZE
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    def body():
+        # Serialize one project at a time; fetch one extra row to find out
+        # whether there is a next page. Unlike the HTML list, the API gives
+        # the whole Description, the same as /api/projects/<id>
+        yield '{"projects": ['
+        last_id = None
+        next_after = None
+        for index, project in enumerate(iterProjects(after, limit + 1, full_text=True)):
+            if index == limit:
+                next_after = last_id
+                continue
+            yield (',' if index else '') + json.dumps(dict(project))
+            last_id = project['id']
+        yield '], "limit": %d, "next_after": %s}' % (limit, json.dumps(next_after))
+
+    response = app.response_class(body(), mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/projects/<int:project_id>')
+@edge_cache.cached('projects')
+def api_project(project_id):
+    etag = api_etag()
+    not_modified = api_not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    project = getProjectById(project_id)
+    if not project:
+        return jsonify(error='Project not found.'), 404
+    response = jsonify(dict(project))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 # Route for contact page
 @app.route('/contact')
 def contact():
-    return render_template('contact.html')
+    return page_cache.page('contact.html')
 
 # Route for add project form page
 @app.route('/add_project')
 def add_project():
     return render_template('add_project.html')
 
+# The image for a project form: an uploaded file wins over a typed filename.
+# Call it once the form is valid, so a rejected form stores nothing
+def project_image():
+    upload = request.files.get('image_file')
+    if upload and upload.filename:
+        return image_uploads.save(upload) or request.form.get('image_filename')
+    return request.form.get('image_filename')
+
+# Once the project is written: make an uploaded image's variants now, so no
+# page render has to make them. If the write failed, drop the stored upload
+def finish_project_image(image_filename, written):
+    if written:
+        if image_filename.startswith(UPLOADS_DIRNAME + '/'):
+            image_variants.variants(image_filename)
+    else:
+        image_uploads.discard_saved()
+
 # Route for handling project form submission
 @app.route('/submit_project', methods=['POST'])
+@edge_cache.purges('projects')
+@image_uploads.accepts
+@rate_limiter.limit(per_minute=10, burst=5, overloaded=writes_backed_up)
 def submit_project():
-    # Get form data
-    title = request.form.get('title')
-    description = request.form.get('description')
-    image_filename = request.form.get('image_filename')
+    # Get form data (an oversized image fails while the form is read)
+    try:
+        title = request.form.get('title')
+        description = request.form.get('description')
+    except RequestEntityTooLarge as e:
+        flash(e.description, 'error')
+        return redirect(url_for('add_project'))
     
     # Basic validation
     if not title or not description:
         flash('Title and Description are required fields.', 'error')
         return redirect(url_for('add_project'))
+
+    # Only a valid form gets its upload stored
+    try:
+        image_filename = project_image()
+    except UploadRejected as e:
+        flash(str(e), 'error')
+        return redirect(url_for('add_project'))
     
     # If no image filename provided, use placeholder
     if not image_filename:
@@ -72,11 +380,13 @@ def submit_project():
     try:
         # Save project to database
         saveProjectDB(title, description, image_filename)
-        flash('Project added successfully!', 'success')
-        return redirect(url_for('projects'))
     except Exception as e:
+        finish_project_image(image_filename, False)
         flash(f'Error adding project: {str(e)}', 'error')
         return redirect(url_for('add_project'))
+    finish_project_image(image_filename, True)
+    flash('Project added successfully!', 'success')
+    return redirect(url_for('projects'))
 
 # Route for editing a project
 @app.route('/edit_project/<int:project_id>')
@@ -89,16 +399,29 @@ def edit_project(project_id):
 
 # Route for handling project update
 @app.route('/update_project/<int:project_id>', methods=['POST'])
+@edge_cache.purges('projects')
+@image_uploads.accepts
+@rate_limiter.limit(per_minute=30, burst=10, overloaded=writes_backed_up)
 def update_project(project_id):
-    # Get form data
-    title = request.form.get('title')
-    description = request.form.get('description')
-    image_filename = request.form.get('image_filename')
+    # Get form data (an oversized image fails while the form is read)
+    try:
+        title = request.form.get('title')
+        description = request.form.get('description')
+    except RequestEntityTooLarge as e:
+        flash(e.description, 'error')
+        return redirect(url_for('edit_project', project_id=project_id))
     
     # Basic validation
     if not title or not description:
         flash('Title and Description are required fields.', 'error')
         return redirect(url_for('edit_project', project_id=project_id))
+
+    # Only a valid form gets its upload stored
+    try:
+        image_filename = project_image()
+    except UploadRejected as e:
+        flash(str(e), 'error')
+        return redirect(url_for('edit_project', project_id=project_id))
     
     # If no image filename provided, use placeholder
     if not image_filename:
@@ -107,17 +430,21 @@ def update_project(project_id):
     try:
         # Update project in database
         success = updateProjectById(project_id, title, description, image_filename)
-        if success:
-            flash('Project updated successfully!', 'success')
-        else:
-            flash('Project not found or no changes made.', 'error')
-        return redirect(url_for('projects'))
     except Exception as e:
+        finish_project_image(image_filename, False)
         flash(f'Error updating project: {str(e)}', 'error')
         return redirect(url_for('edit_project', project_id=project_id))
+    finish_project_image(image_filename, success)
+    if success:
+        flash('Project updated successfully!', 'success')
+    else:
+        flash('Project not found or no changes made.', 'error')
+    return redirect(url_for('projects'))
 
 # Route for deleting a project
 @app.route('/delete_project/<int:project_id>', methods=['POST'])
+@edge_cache.purges('projects')
+@rate_limiter.limit(per_minute=30, burst=10, overloaded=writes_backed_up)
 def delete_project(project_id):
     try:
         success = deleteProjectById(project_id)
@@ -132,10 +459,11 @@ def delete_project(project_id):
 # Route for thank you page
 @app.route('/thankyou')
 def thankyou():
-    return render_template('thankyou.html')
+    return page_cache.page('thankyou.html')
 
 # Handle form submission from contact page
 @app.route('/submit_contact', methods=['POST'])
+@rate_limiter.limit(per_minute=5, burst=3, overloaded=contacts_backed_up)
 def submit_contact():
     # Get form data
     first_name = request.form.get('firstName')
@@ -155,18 +483,62 @@ def submit_contact():
     if len(password) < 8:
         return redirect(url_for('contact') + '?error=password_too_short')
     
-    # In a real application, you would save this data to a database
-    # For now, we'll just redirect to the thank you page
+    # Hash the password and save the submission off the request thread.
+    # If too many are already waiting, ask the client to retry shortly
+    try:
+        contact_queue.submit(first_name, last_name, email, password, message)
+    except ContactQueueFull:
+        response = page_cache.page('contact.html', status=503)
+        response.headers['Retry-After'] = '5'
+        return response
+
     return redirect(url_for('thankyou'))
 
+# Compile every template up front (through the bytecode cache, so later
+# processes only load them). Also run during the Docker build
+def compile_templates():
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+# Seconds spent in each startup phase, reported by preload() and /metrics
+startup_timings = {}
+
+registry.add_collector(lambda: [('startup_duration_seconds', 'gauge', 'Time spent in each startup phase.',
+                                 (('phase', phase),), seconds) for phase, seconds in startup_timings.items()])
+
+# Load everything a worker would otherwise do lazily on its first requests.
+# Gunicorn calls this in the master before forking (see gunicorn.conf.py),
+# so every worker starts with compiled templates and indexed files
+def preload():
+    started = time.perf_counter()
+    createDatabase()
+    startup_timings['db_init'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    count = compile_templates()
+    startup_timings['templates'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    static_index.scan()
+    resume_index.lookup('resume.pdf')
+    startup_timings['files'] = time.perf_counter() - started
+
+    report = ', '.join(f'{phase} {seconds * 1000:.1f} ms' for phase, seconds in startup_timings.items())
+    cache = 'bytecode cache ' + TEMPLATE_CACHE_DIR if app.jinja_env.bytecode_cache else 'no bytecode cache'
+    print(f"Startup: {report} ({count} templates, {cache})")
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
-    return render_template('index.html'), 404
+    return page_cache.page('index.html', status=404)
 
 @app.errorhandler(500)
 def internal_error(error):
-    return render_template('index.html'), 500
+    return page_cache.page('index.html', status=500)
+
+startup_timings['import'] = time.perf_counter() - IMPORT_STARTED
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -189,4 +561,5 @@ if __name__ == '__main__':
     print("Press Ctrl+C to stop the server")
     print("=" * 60)
     
+    preload()
     app.run(debug=True, host='0.0.0.0', port=8000)
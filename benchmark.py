@@ -0,0 +1,434 @@
+"""
+Benchmarks for the DAL and the Flask routes against synthetic databases
+
+    python benchmark.py                          # 1k and 10k rows
+    python benchmark.py --rows 10000 100000 --concurrency 1 8 32
+    python benchmark.py --url http://127.0.0.1:8000    # also load an external server (e.g. gunicorn)
+    python benchmark.py compare old.json new.json
+
+Each database size gets its own file (kept under ``--workdir`` so later runs
+reuse it). Results are written as JSON to ``benchmark-results/``, named after
+the commit, so two runs can be compared with ``compare``.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import DAL
+
+DEFAULT_ROWS = (1000, 10000)
+DEFAULT_CONCURRENCY = (1, 8)
+RESULTS_DIR = 'benchmark-results'
+
+# Words the synthetic titles and descriptions are built from
+WORDS = ('flask', 'sqlite', 'python', 'website', 'portfolio', 'analytics', 'dashboard',
+         'pipeline', 'scraper', 'game', 'robot', 'sensor', 'cloud', 'mobile', 'api',
+         'search', 'render', 'cache', 'stream', 'model', 'vision', 'parser', 'compiler',
+         'network', 'budget', 'weather', 'music', 'chess', 'garden', 'fitness')
+
+# A regression is only reported when it is worse by more than this fraction
+COMPARE_THRESHOLD = 0.10
+
+
+#######################################################
+# SYNTHETIC DATA
+#######################################################
+def synthetic_rows(count, seed=0):
+    """Yield ``count`` reproducible (Title, Description, ImageFileName) rows."""
+    rng = random.Random(seed)
+    for number in range(count):
+        title = ' '.join(rng.choice(WORDS) for _ in range(3)).title() + f' {number}'
+        description = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 60))).capitalize() + '.'
+        image = '' if number % 10 == 0 else f'project{number % 50}.jpg'
+        yield title, description, image
+
+
+def build_database(path, rows):
+    """Create ``path`` holding ``rows`` synthetic projects, reusing it if it already does."""
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            if conn.execute("SELECT COUNT(*) FROM projects").fetchone()[0] == rows:
+                return path
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    with use_database(path):
+        DAL.createDatabase()
+        DAL.bulkSaveProjects(synthetic_rows(rows))
+    return path
+
+
+class use_database:
+    """Point the DAL at another database file for the duration of a ``with`` block."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.original = DAL.DB_PATH
+        DAL.closeAllConnections()
+        DAL.DB_PATH = self.path
+        return self.path
+
+    def __exit__(self, *exc_info):
+        DAL.closeAllConnections()
+        DAL.DB_PATH = self.original
+
+
+#######################################################
+# TIMING
+#######################################################
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_samples)) - 1)
+    return sorted_samples[rank]
+
+
+def summarize(samples, elapsed=None):
+    """Count, throughput and latency percentiles (in milliseconds) of a list of seconds."""
+    samples = sorted(samples)
+    summary = {'count': len(samples)}
+    if not samples:
+        return summary
+    if elapsed:
+        summary['throughput_per_s'] = round(len(samples) / elapsed, 1)
+    summary['mean_ms'] = round(sum(samples) / len(samples) * 1000, 3)
+    for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        summary[name] = round(percentile(samples, fraction) * 1000, 3)
+    summary['max_ms'] = round(samples[-1] * 1000, 3)
+    return summary
+
+
+def time_calls(function, iterations, setup=None):
+    """Call ``function`` ``iterations`` times and summarize how long each call took."""
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, time.perf_counter() - started)
+
+
+#######################################################
+# DAL MICRO-BENCHMARKS
+#######################################################
+def run_dal_benchmarks(rows, iterations):
+    """Time every DAL function against the current database; returns {name: summary}.
+
+    "cold" runs empty the read-through cache before each call, so they measure
+    the query itself; "warm" runs measure a cache hit. The cache's watcher
+    connection stays open, as it would in a running worker.
+    """
+    rng = random.Random(1)
+    ids = [rng.randint(1, rows) for _ in range(iterations)] if rows else [1]
+    middle = rows // 2
+    results = {}
+
+    def cold(name, function, count=iterations):
+        results[name] = time_calls(function, count, setup=DAL.invalidateCache)
+
+    def warm(name, function, count=iterations):
+        function()
+        results[name] = time_calls(function, count)
+
+    # Reads
+    scans = max(1, min(iterations, 10))
+    cold('getAllProjects[cold]', DAL.getAllProjects, scans)
+    warm('getAllProjects[warm]', DAL.getAllProjects)
+    cold('iterProjects[full scan]', lambda: sum(1 for _ in DAL.iterProjects()), scans)
+    cold('getProjectsPage[first]', lambda: DAL.getProjectsPage())
+    cold('getProjectsPage[middle]', lambda: DAL.getProjectsPage(after=middle))
+    warm('getProjectsPage[warm]', lambda: DAL.getProjectsPage(after=middle))
+    next_id = iter(ids * 2)
+    cold('getProjectById[cold]', lambda: DAL.getProjectById(next(next_id)))
+    warm('getProjectById[warm]', lambda: DAL.getProjectById(ids[0]))
+    terms = iter([rng.choice(WORDS) for _ in range(iterations)])
+    cold('searchProjects[one word]', lambda: DAL.searchProjects(next(terms)))
+    pairs = iter([f'{rng.choice(WORDS)} {rng.choice(WORDS)}' for _ in range(iterations)])
+    cold('searchProjects[two words]', lambda: DAL.searchProjects(next(pairs)))
+
+    # Writes (they invalidate the cache themselves)
+    results['saveProjectDB'] = time_calls(
+        lambda: DAL.saveProjectDB('Benchmark', 'Written by the benchmark suite', ''), iterations)
+    update_ids = iter(ids * 2)
+    results['updateProjectById'] = time_calls(
+        lambda: DAL.updateProjectById(next(update_ids), 'Updated', 'Updated by the benchmark suite', ''),
+        iterations)
+    batch = list(synthetic_rows(1000, seed=2))
+    results['bulkSaveProjects[1000 rows]'] = time_calls(lambda: DAL.bulkSaveProjects(batch), max(1, iterations // 20))
+
+    return results
+
+
+#######################################################
+# HTTP LOAD
+#######################################################
+def route_paths(rows):
+    """The GET requests a load run cycles through."""
+    middle = rows // 2
+    return {
+        'index': '/',
+        'projects': '/projects',
+        'projects[middle page]': f'/projects?after={middle}',
+        'search': '/projects/search?q=flask+cache',
+        'healthz': '/healthz',
+    }
+
+
+def run_load(send, paths, concurrency, requests_per_path):
+    """Send every path ``requests_per_path`` times from ``concurrency`` threads.
+
+    ``send(path)`` returns the status code. Returns {name: summary} plus an
+    "all" entry for the mix.
+    """
+    work = [(name, path) for name, path in paths.items() for _ in range(requests_per_path)]
+    random.Random(3).shuffle(work)
+    samples = {name: [] for name in paths}
+    errors = {name: 0 for name in paths}
+    lock = threading.Lock()
+
+    def one(item):
+        name, path = item
+        start = time.perf_counter()
+        try:
+            ok = send(path) < 400
+        except (OSError, urllib.error.URLError):
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples[name].append(elapsed)
+            if not ok:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, work))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in paths:
+        # Throughput per route is its share of the mixed run
+        results[name] = dict(summarize(samples[name], elapsed), errors=errors[name])
+    every = [sample for values in samples.values() for sample in values]
+    results['all'] = dict(summarize(every, elapsed), errors=sum(errors.values()))
+    return results
+
+
+def client_sender(app):
+    client = app.test_client()
+
+    def send(path):
+        response = client.get(path)
+        # Drain streamed bodies so the whole page is timed
+        response.get_data()
+        return response.status_code
+    return send
+
+
+def http_sender(base_url):
+    def send(path):
+        try:
+            with urllib.request.urlopen(base_url + path, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+    return send
+
+
+class local_server:
+    """Serve the app from a threaded werkzeug server on a free port in the background."""
+
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def run_http_benchmarks(rows, concurrency_levels, requests_per_path, external_url=None):
+    """Load the app through the test client, a local server and optionally ``external_url``."""
+    from app import app
+
+    paths = route_paths(rows)
+    results = {}
+    with local_server(app) as url:
+        targets = [('test_client', client_sender(app)), ('local_server', http_sender(url))]
+        if external_url:
+            targets.append(('external', http_sender(external_url.rstrip('/'))))
+        for target, send in targets:
+            for concurrency in concurrency_levels:
+                results[f'{target}[c={concurrency}]'] = run_load(send, paths, concurrency, requests_per_path)
+    return results
+
+
+#######################################################
+# RESULTS
+#######################################################
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def flatten(results):
+    """Map "<rows>/<group>/<case>" to each case's summary."""
+    flat = {}
+    for size, groups in results['sizes'].items():
+        for group, cases in groups.items():
+            for case, summary in cases.items():
+                if isinstance(summary, dict) and 'p50_ms' in summary:
+                    flat[f'{size}/{group}/{case}'] = summary
+                elif isinstance(summary, dict):
+                    for sub_case, sub_summary in summary.items():
+                        flat[f'{size}/{group}/{case}/{sub_case}'] = sub_summary
+    return flat
+
+
+def compare(old, new, threshold=COMPARE_THRESHOLD):
+    """Return (case, old p50, new p50, change) for cases present in both runs, and the regressions."""
+    old_flat, new_flat = flatten(old), flatten(new)
+    rows, regressions = [], []
+    for case in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[case].get('p50_ms'), new_flat[case].get('p50_ms')
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        rows.append((case, before, after, change))
+        if change > threshold:
+            regressions.append(case)
+    return rows, regressions
+
+
+def print_summary(results):
+    for case, summary in flatten(results).items():
+        throughput = summary.get('throughput_per_s')
+        throughput = f'{throughput:>10.1f}/s' if throughput is not None else ''
+        print(f"{case:<60} p50 {summary['p50_ms']:>9.3f} ms  p95 {summary['p95_ms']:>9.3f} ms  "
+              f"p99 {summary['p99_ms']:>9.3f} ms {throughput}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DAL and routes at realistic data sizes.")
+    commands = parser.add_subparsers(dest='command')
+
+    compare_command = commands.add_parser('compare', help="Compare two result files")
+    compare_command.add_argument('old')
+    compare_command.add_argument('new')
+    compare_command.add_argument('--threshold', type=float, default=COMPARE_THRESHOLD,
+                                 help="Fractional slowdown of p50 reported as a regression")
+
+    parser.add_argument('--rows', type=int, nargs='+', default=list(DEFAULT_ROWS),
+                        help="Database sizes to generate and test")
+    parser.add_argument('--iterations', type=int, default=200, help="Calls per DAL benchmark")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=list(DEFAULT_CONCURRENCY),
+                        help="Client threads for each HTTP load run")
+    parser.add_argument('--requests', type=int, default=100, help="Requests per route in each load run")
+    parser.add_argument('--url', help="Also load an already running server (e.g. gunicorn) at this base URL; it serves its own database")
+    parser.add_argument('--skip-http', action='store_true', help="Only run the DAL benchmarks")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'projects-benchmark'),
+                        help="Where the synthetic databases are kept between runs")
+    parser.add_argument('--output', help="Result file (default: benchmark-results/<commit>.json)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        rows, regressions = compare(old, new, args.threshold)
+        for case, before, after, change in rows:
+            marker = '  <-- slower' if case in regressions else ''
+            print(f"{case:<60} {before:>9.3f} -> {after:>9.3f} ms p50 ({change:+.0%}){marker}")
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {'environment': environment(), 'settings': vars(args), 'sizes': {}}
+    for rows in args.rows:
+        path = os.path.join(args.workdir, f'projects-{rows}.db')
+        print(f"Preparing {rows} rows in {path}", file=sys.stderr)
+        build_database(path, rows)
+        # Benchmarks write to the database, so run them against a copy
+        scratch = path + '.run'
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(scratch + suffix):
+                os.remove(scratch + suffix)
+        source, target = sqlite3.connect(path), sqlite3.connect(scratch)
+        source.backup(target)
+        source.close()
+        target.close()
+
+        with use_database(scratch):
+            size = results['sizes'][str(rows)] = {}
+            print(f"DAL benchmarks at {rows} rows", file=sys.stderr)
+            size['dal'] = run_dal_benchmarks(rows, args.iterations)
+            if not args.skip_http:
+                print(f"HTTP load at {rows} rows", file=sys.stderr)
+                size['http'] = run_http_benchmarks(rows, args.concurrency, args.requests, args.url)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(scratch + suffix):
+                os.remove(scratch + suffix)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = results['environment']['commit'] or 'results'
+        if results['environment']['dirty']:
+            name += '-dirty'
+        output = os.path.join(RESULTS_DIR, f'{name}.json')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print_summary(results)
+    print(f"Results written to {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
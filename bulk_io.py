@@ -0,0 +1,167 @@
+"""
+Bulk import and streaming export of projects as CSV or NDJSON
+
+    python bulk_io.py import projects.csv
+    python bulk_io.py import projects.ndjson
+    python bulk_io.py export --format csv > projects.csv
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+
+from DAL import bulkSaveProjects, iterProjects
+
+FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = ('id', 'Title', 'Description', 'ImageFileName')
+MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# Column names accepted for each field: the DAL's and the HTML form's
+FIELD_ALIASES = {
+    'Title': ('Title', 'title'),
+    'Description': ('Description', 'description'),
+    'ImageFileName': ('ImageFileName', 'image_filename', 'Image'),
+}
+
+
+def guess_format(filename=None, mimetype=None):
+    """Pick csv or ndjson from a file name or content type."""
+    if filename:
+        if filename.lower().endswith('.csv'):
+            return 'csv'
+        if filename.lower().endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+    if mimetype == 'text/csv':
+        return 'csv'
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'ndjson'
+    return None
+
+
+def read_rows(text_stream, fmt):
+    """Yield validated (Title, Description, ImageFileName) tuples from a text stream.
+
+    Raises ValueError naming the line of the first invalid record.
+    """
+    if fmt == 'csv':
+        records = csv.DictReader(text_stream)
+        # Line 1 is the header
+        numbered = enumerate(records, start=2)
+    elif fmt == 'ndjson':
+        numbered = _ndjson_records(text_stream)
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+    for line_number, record in numbered:
+        title = _field(record, 'Title')
+        description = _field(record, 'Description')
+        if not title or not description:
+            raise ValueError(f"Line {line_number}: Title and Description are required fields.")
+        yield title, description, _field(record, 'ImageFileName') or "placeholder.png"
+
+
+def text_reader(binary_stream):
+    """Decode a binary stream (an upload or a request body) as UTF-8 for ``read_rows``.
+
+    Only ``read`` is used, so it works on any file-like object, including
+    the SpooledTemporaryFile Werkzeug puts uploads in, which before Python
+    3.11 has no ``readable()`` for io.TextIOWrapper to check.
+    """
+    return io.TextIOWrapper(io.BufferedReader(_RawReader(binary_stream)), encoding='utf-8', newline='')
+
+
+class _RawReader(io.RawIOBase):
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def import_projects(text_stream, fmt):
+    """Import every record in the stream in chunked transactions; returns the count.
+
+    Records are validated as they are read, so a bad record stops the import
+    with a ValueError; chunks committed before it stay in the database.
+    """
+    return bulkSaveProjects(read_rows(text_stream, fmt))
+
+
+def export_projects(fmt):
+    """Yield the whole projects table as CSV or NDJSON text, one row at a time."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for project in iterProjects(full_text=True):
+            writer.writerow((project['id'], project['Title'], project['Description'], project['Image']))
+            # Hand back what the writer produced and reuse the buffer
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Only the header is left if the table was empty
+        if buffer.getvalue():
+            yield buffer.getvalue()
+    elif fmt == 'ndjson':
+        for project in iterProjects(full_text=True):
+            yield json.dumps({'id': project['id'], 'Title': project['Title'],
+                              'Description': project['Description'],
+                              'ImageFileName': project['Image']}) + '\n'
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _ndjson_records(text_stream):
+    for line_number, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {line_number}: not valid JSON.")
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {line_number}: expected a JSON object.")
+        yield line_number, record
+
+
+def _field(record, name):
+    for alias in FIELD_ALIASES[name]:
+        value = record.get(alias)
+        if value:
+            return str(value).strip()
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import or export projects.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_command = commands.add_parser('import', help="Import a CSV or NDJSON file")
+    import_command.add_argument('file')
+    import_command.add_argument('--format', choices=FORMATS)
+
+    export_command = commands.add_parser('export', help="Write every project to stdout")
+    export_command.add_argument('--format', choices=FORMATS, default='ndjson')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        fmt = args.format or guess_format(args.file)
+        if fmt is None:
+            parser.error("Can't tell the file format; pass --format csv or --format ndjson.")
+        with open(args.file, newline='', encoding='utf-8') as f:
+            count = import_projects(f, fmt)
+        print(f"Imported {count} projects.")
+    else:
+        for chunk in export_projects(args.format):
+            sys.stdout.write(chunk)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Response compression: precompressed siblings for files, gzip on the fly for pages
+
+Run ``python compression.py`` at build time to write ``.gz``/``.br`` files
+next to the static assets and resume.pdf; anything missing is written the
+first time the file is served.
+"""
+import gzip
+import os
+import tempfile
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Types worth compressing; images and fonts are already compressed
+COMPRESSIBLE_TYPES = frozenset((
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson',
+    'application/xml', 'image/svg+xml', 'application/pdf',
+))
+
+# Below this many bytes the headers cost more than compression saves
+MIN_SIZE = 500
+
+# Precompressed siblings, best first
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Compress a streamed body every time this much input has built up. The
+# first this many bytes (the page head) are flushed chunk by chunk instead,
+# so the browser can start on the stylesheets while the rows are fetched
+STREAM_FLUSH_SIZE = 4096
+
+
+def available_encodings():
+    """Return the encodings we can produce, best first."""
+    return tuple(name for name in ENCODING_SUFFIXES if name != 'br' or brotli is not None)
+
+
+def is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_TYPES
+
+
+def precompress(path, encodings=None):
+    """Write compressed siblings of ``path`` that are missing or older than it.
+
+    Raises OSError if a sibling can't be written.
+    """
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        data = None
+        for encoding in encodings or available_encodings():
+            target = path + ENCODING_SUFFIXES[encoding]
+            try:
+                if os.stat(target).st_mtime_ns >= stat.st_mtime_ns:
+                    continue
+            except OSError:
+                pass
+            if data is None:
+                data = f.read()
+            if encoding == 'br':
+                compressed = brotli.compress(data, quality=11)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            # A unique temporary per writer: other threads and workers may be
+            # compressing the same file right now
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(target),
+                                             prefix=os.path.basename(target) + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(compressed)
+                # mkstemp makes the file private; nginx has to be able to read it
+                os.chmod(temporary, 0o644)
+                os.replace(temporary, target)
+            except BaseException:
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+                raise
+
+
+class Compress:
+    """Gzip dynamic responses that the client accepts and nothing upstream encoded.
+
+    Bodies smaller than ``min_size`` are left alone, streamed bodies (such as
+    /projects) are compressed chunk by chunk so they keep streaming, and file
+    responses are skipped because they already negotiate precompressed
+    siblings. Responses that already carry a Content-Encoding are never
+    touched, and nginx in turn never re-compresses a response that has one.
+    """
+
+    def __init__(self, app=None, min_size=MIN_SIZE, level=6):
+        self.min_size = min_size
+        self.level = level
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def after_request(self, response):
+        # File responses negotiate their own precompressed siblings
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+        if not is_compressible(response.mimetype):
+            return response
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings['gzip'] <= 0:
+            return response
+
+        # A strong ETag describes the identity bytes; a weak one still matches
+        # If-None-Match for every encoding of the same page
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+
+        if response.is_streamed:
+            response.response = _gzip_stream(response.response, self.level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(gzip.compress(data, compresslevel=self.level))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+
+def _gzip_stream(iterable, level):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = 0
+    total = 0
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            pending += len(chunk)
+            total += len(chunk)
+            # Flush every chunk of the head (the next one may wait on the
+            # database), then regularly so the page still arrives progressively
+            if total <= STREAM_FLUSH_SIZE or pending >= STREAM_FLUSH_SIZE:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+                pending = 0
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+if __name__ == '__main__':
+    root = os.path.dirname(os.path.abspath(__file__))
+    targets = [os.path.join(root, 'resume.pdf')]
+    for folder, _, files in os.walk(os.path.join(root, 'static')):
+        targets += [os.path.join(folder, name) for name in files
+                    if os.path.splitext(name)[1] in ('.css', '.js', '.svg', '.json')]
+    for target in targets:
+        precompress(target)
+        print(f"Precompressed {os.path.relpath(target, root)}")
@@ -0,0 +1,21 @@
+"""
+Run the tests against a throwaway database instead of the real projects.db
+
+DB_PATH is read when DAL is imported, so it is set here, before pytest
+imports the test modules (and with them the app and the DAL). The app's
+settings below are read the same way.
+"""
+import os
+import shutil
+import tempfile
+
+TEST_DATA_DIR = tempfile.mkdtemp(prefix='portfolio-tests-')
+os.environ['DB_PATH'] = os.path.join(TEST_DATA_DIR, 'projects.db')
+
+# The route tests post from one client far faster than the write limits
+# allow; the rate limiter tests turn the limits back on themselves
+os.environ['RATE_LIMITS_ENABLED'] = '0'
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TEST_DATA_DIR, ignore_errors=True)
@@ -0,0 +1,147 @@
+"""
+Contact form submissions: hashed off the request thread, saved in batches
+
+``submit_contact`` only validates the form and hands it to ``ContactQueue``,
+so it returns in constant time. A background thread hashes the passwords
+with scrypt on a small process pool (the KDF is deliberately CPU- and
+memory-heavy) and writes the hashed submissions with one commit per batch.
+When the queue is full, ``submit`` raises ``ContactQueueFull`` and the
+caller should answer 503.
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from DAL import saveContacts
+
+# scrypt cost: 2**14 * 8 * 128 bytes = 16 MiB of memory per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Processes hashing at once, submissions waiting to be hashed, and how
+# many are written per transaction
+HASH_WORKERS = 2
+QUEUE_SIZE = 256
+BATCH_SIZE = 32
+
+# Once a batch has started, wait this long for more submissions to join it
+BATCH_WINDOW = 0.05
+
+
+def hash_password(password):
+    """Return an ``scrypt$n$r$p$salt$key`` string for ``password``."""
+    salt = os.urandom(SALT_BYTES)
+    key = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                         dklen=KEY_BYTES)
+    return '$'.join(('scrypt', str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P),
+                     base64.b64encode(salt).decode(), base64.b64encode(key).decode()))
+
+
+def verify_password(password, encoded):
+    """Check ``password`` against a string made by ``hash_password``."""
+    try:
+        scheme, n, r, p, salt, key = encoded.split('$')
+    except (AttributeError, ValueError):
+        return False
+    if scheme != 'scrypt':
+        return False
+    key = base64.b64decode(key)
+    candidate = hashlib.scrypt(password.encode('utf-8'), salt=base64.b64decode(salt),
+                               n=int(n), r=int(r), p=int(p), dklen=len(key))
+    return hmac.compare_digest(candidate, key)
+
+
+class ContactQueueFull(Exception):
+    """Raised by ``ContactQueue.submit`` when too many submissions are waiting."""
+
+
+class ContactQueue:
+    """Bounded queue of contact submissions, drained by a background writer thread.
+
+    The hashing pool and the thread are started on first use in each
+    process, so a queue created before gunicorn forks works in every worker.
+    """
+
+    def __init__(self, max_size=QUEUE_SIZE, hash_workers=HASH_WORKERS, batch_size=BATCH_SIZE):
+        self.max_size = max_size
+        self.hash_workers = hash_workers
+        self.batch_size = batch_size
+        self._queue = None
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, first_name, last_name, email, password, message):
+        """Queue one submission for hashing and saving, without waiting for either."""
+        try:
+            self._started().put_nowait((first_name, last_name, email, password, message))
+        except queue.Full:
+            raise ContactQueueFull("Too many contact submissions are waiting to be saved.")
+
+    def pending(self):
+        """Submissions accepted but not saved yet."""
+        return self._queue.unfinished_tasks if self._queue is not None else 0
+
+    def join(self, timeout=None):
+        """Wait until every accepted submission is saved; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=10):
+        """Save what is still queued (up to ``timeout`` seconds), then stop the hashing pool."""
+        if self._pid != os.getpid():
+            return
+        self.join(timeout)
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._queue = self._pid = None
+
+    def _started(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # spawn, not fork: the worker forking it is already running threads
+                self._pool = ProcessPoolExecutor(max_workers=self.hash_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+                self._queue = queue.Queue(maxsize=self.max_size)
+                threading.Thread(target=self._run, args=(self._queue, self._pool),
+                                 name='contact-writer', daemon=True).start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _run(self, submissions, pool):
+        while True:
+            # A. Block for one submission, then let a batch build up briefly
+            batch = [submissions.get()]
+            deadline = time.monotonic() + BATCH_WINDOW
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(submissions.get(timeout=remaining) if remaining > 0 else submissions.get_nowait())
+                except queue.Empty:
+                    break
+
+            # B. Hash the passwords in parallel on the process pool, then
+            #    write the batch in one transaction
+            try:
+                hashes = pool.map(hash_password, [password for _, _, _, password, _ in batch])
+                saveContacts((first, last, email, password_hash, message)
+                             for (first, last, email, _, message), password_hash in zip(batch, hashes))
+            except Exception as e:
+                print(f"Could not save {len(batch)} contact submissions: {e}")
+            finally:
+                for _ in batch:
+                    submissions.task_done()
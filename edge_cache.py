@@ -0,0 +1,111 @@
+"""
+Surrogate keys and purge-on-write for the nginx micro-cache
+
+Views tagged with ``@edge_cache.cached('projects')`` answer with a
+``Surrogate-Key`` header and ``X-Accel-Expires``, which tells nginx how many
+seconds it may serve the page from its cache. Views tagged with
+``@edge_cache.purges('projects')`` refresh every cached page carrying that
+key once they succeed, so readers see a write immediately instead of after
+the TTL.
+
+Stock nginx can't purge by key, so a purge re-requests each URL this
+process served under the key from nginx's internal refresh listener
+(``EDGE_PURGE_URL``, see nginx.conf), which always bypasses and replaces the
+cached copy. Pages only other workers served simply expire after the TTL.
+"""
+import queue
+import threading
+import urllib.error
+import urllib.request
+
+from flask import request, session
+
+# How long nginx may serve a tagged response without asking the app
+DEFAULT_MAX_AGE = 5
+
+# URLs remembered per key for purging
+MAX_URLS_PER_KEY = 256
+
+
+class EdgeCache:
+    """Emit surrogate keys on cacheable views and refresh them after writes."""
+
+    def __init__(self, app=None, max_age=DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self.purge_url = None
+        self._cached = {}
+        self._purges = {}
+        self._urls = {}
+        self._lock = threading.Lock()
+        self._queue = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.purge_url = (app.config.get('EDGE_PURGE_URL') or '').rstrip('/') or None
+        app.after_request(self.after_request)
+
+    def cached(self, *keys):
+        """Mark a view's successful responses as cacheable under ``keys``."""
+        def decorator(view):
+            self._cached[view.__name__] = keys
+            return view
+        return decorator
+
+    def purges(self, *keys):
+        """Purge ``keys`` whenever this view succeeds."""
+        def decorator(view):
+            self._purges[view.__name__] = keys
+            return view
+        return decorator
+
+    def after_request(self, response):
+        if response.status_code >= 400:
+            return response
+
+        keys = self._cached.get(request.endpoint)
+        # A response that changes the session (e.g. consumes a flash message)
+        # sets a cookie and is personal; nginx won't store it either
+        if keys and request.method == 'GET' and not session.modified:
+            response.headers['Surrogate-Key'] = ' '.join(keys)
+            response.headers['X-Accel-Expires'] = str(self.max_age)
+            self._remember(keys, request.full_path.rstrip('?'))
+
+        keys = self._purges.get(request.endpoint)
+        if keys:
+            self.purge(*keys)
+        return response
+
+    def purge(self, *keys):
+        """Refresh every remembered URL tagged with any of ``keys``; returns those URLs."""
+        with self._lock:
+            urls = sorted(set().union(*(self._urls.get(key, ()) for key in keys)))
+        if self.purge_url and urls:
+            for url in urls:
+                self._sender().put(self.purge_url + url)
+        return urls
+
+    def _remember(self, keys, url):
+        with self._lock:
+            for key in keys:
+                urls = self._urls.setdefault(key, set())
+                if len(urls) < MAX_URLS_PER_KEY:
+                    urls.add(url)
+
+    def _sender(self):
+        # Refresh in the background: a write route shouldn't wait for nginx
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                threading.Thread(target=self._send_all, args=(self._queue,),
+                                 name='edge-purge', daemon=True).start()
+            return self._queue
+
+    def _send_all(self, urls):
+        while True:
+            url = urls.get()
+            try:
+                with urllib.request.urlopen(url, timeout=2) as response:
+                    response.read()
+            except (OSError, urllib.error.URLError):
+                pass
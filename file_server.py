@@ -0,0 +1,238 @@
+"""
+Conditional, byte-range file serving backed by an in-memory metadata index
+"""
+import hashlib
+import mimetypes
+import mmap
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import abort, current_app, request
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+from compression import ENCODING_SUFFIXES, MIN_SIZE, is_compressible, precompress
+
+# Files named by their content never change under the same URL, so they
+# can be cached forever. Only the two names this app generates count: image
+# variants (``headshot-320w.<12 hex>.webp``, images.py) and uploads
+# (``<64 hex sha256>.png``, uploads.py). The hash must contain a letter, so
+# date-stamped names like ``IMG_20231105.jpg`` never match
+FINGERPRINT_PATTERN = re.compile(r'(-\d+w\.(?=[0-9]*[a-f])[0-9a-f]{12}'
+                                 r'|^(?=[0-9]*[a-f])[0-9a-f]{64})\.[A-Za-z0-9]+$')
+IMMUTABLE_MAX_AGE = 31536000
+
+# Size of each chunk read from a memory-mapped file
+CHUNK_SIZE = 64 * 1024
+
+
+class FileInfo:
+    """Everything needed to answer a request for a file without re-reading it."""
+
+    __slots__ = ('path', 'size', 'mtime', 'last_modified', 'etag',
+                 'mimetype', 'immutable', 'checked_at')
+
+    def __init__(self, path, stat, etag, mimetype, immutable):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime_ns
+        self.last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+        self.etag = etag
+        self.mimetype = mimetype
+        self.immutable = immutable
+        self.checked_at = time.monotonic()
+
+
+class FileIndex:
+    """In-memory index of size, mtime, ETag and type for files in a directory.
+
+    Entries are built on first lookup (or all at once with ``scan``) and
+    re-checked with a single ``stat`` at most every ``revalidate_interval``
+    seconds. The ETag is a hash of the file contents, so it is only computed
+    again when the size or mtime changes.
+
+    With ``encodings`` (e.g. ``('br', 'gzip')``) compressible files get
+    ``.br``/``.gz`` siblings written next to them the first time they are
+    indexed, and ``send_indexed_file`` picks one by Accept-Encoding.
+
+    ``accel_prefix`` is the internal nginx location that maps to
+    ``directory``; with it, requests that come through nginx are answered
+    with an X-Accel-Redirect and nginx sends the bytes itself.
+    """
+
+    def __init__(self, directory, revalidate_interval=2.0, encodings=(), accel_prefix=None):
+        self.directory = directory
+        self.revalidate_interval = revalidate_interval
+        self.encodings = encodings
+        self.accel_prefix = accel_prefix
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, filename):
+        """Return the FileInfo for ``filename``, or None if it isn't servable."""
+        info = self._entries.get(filename)
+        if info is not None and time.monotonic() - info.checked_at < self.revalidate_interval:
+            return info
+
+        path = safe_join(self.directory, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._forget(filename)
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        # Unchanged on disk: keep the hash we already have
+        if info is not None and info.size == stat.st_size and info.mtime == stat.st_mtime_ns:
+            info.checked_at = time.monotonic()
+            return info
+
+        mimetype, encoding = mimetypes.guess_type(path)
+        mimetype = mimetype or 'application/octet-stream'
+        # Siblings (style.css.gz) are already compressed; never compress them again
+        if self.encodings and encoding is None and is_compressible(mimetype) and stat.st_size >= MIN_SIZE:
+            try:
+                precompress(path, self.encodings)
+            except OSError as e:
+                # Not fatal: without a fresh sibling the file is sent as is
+                print(f"Could not precompress {filename}: {e}")
+
+        info = FileInfo(path, stat, _hash_file(path), mimetype,
+                        bool(FINGERPRINT_PATTERN.search(os.path.basename(path))))
+        with self._lock:
+            self._entries[filename] = info
+        return info
+
+    def scan(self):
+        """Index every file under the directory up front."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                relative = os.path.relpath(os.path.join(root, name), self.directory)
+                self.lookup(relative.replace(os.sep, '/'))
+
+    def _forget(self, filename):
+        with self._lock:
+            self._entries.pop(filename, None)
+
+
+def send_indexed_file(index, filename, max_age=3600, immutable=None):
+    """Serve ``filename`` from ``index`` honoring Range, If-Range and conditional headers.
+
+    ``immutable`` overrides the fingerprint check, for URLs that don't name
+    the file they resolve to.
+    """
+    info = index.lookup(filename)
+    if info is None:
+        abort(404)
+
+    response = current_app.response_class(mimetype=info.mimetype)
+    accel = _use_accel_redirect(index)
+
+    # A. Swap in a precompressed sibling the client accepts. Ranges always
+    #    apply to the uncompressed file. Behind nginx, gzip_static does this
+    if index.encodings and is_compressible(info.mimetype) and not accel:
+        response.vary.add('Accept-Encoding')
+        if request.range is None:
+            for encoding in index.encodings:
+                if request.accept_encodings[encoding] <= 0:
+                    continue
+                sibling = index.lookup(filename + ENCODING_SUFFIXES[encoding])
+                # A sibling older than the file is stale (it couldn't be rewritten)
+                if sibling is not None and sibling.mtime >= info.mtime:
+                    response.content_encoding = encoding
+                    info = sibling
+                    break
+
+    response.set_etag(info.etag)
+    response.last_modified = info.last_modified
+    response.accept_ranges = 'bytes'
+    response.cache_control.public = True
+    if immutable is None:
+        immutable = info.immutable
+    if immutable:
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.max_age = max_age
+
+    # B. If-None-Match / If-Modified-Since
+    if not is_resource_modified(request.environ, etag=info.etag, last_modified=info.last_modified):
+        response.status_code = 304
+        return response
+
+    # C. Behind nginx: hand the file over and let nginx do ranges and sendfile
+    if accel:
+        relative = os.path.relpath(info.path, index.directory).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = f'{index.accel_prefix}/{quote(relative)}'
+        return response
+
+    # D. Range / If-Range: a single satisfiable range gets a 206, several
+    #    ranges fall back to the whole file
+    start, end = 0, info.size
+    if request.range is not None and _if_range_matches(info):
+        span = request.range.range_for_length(info.size)
+        if span is not None:
+            start, end = span
+            response.status_code = 206
+            response.content_range = f'bytes {start}-{end - 1}/{info.size}'
+        elif len(request.range.ranges) == 1:
+            response.status_code = 416
+            response.content_range = f'bytes */{info.size}'
+            return response
+
+    # E. Body: sendfile through the server's file_wrapper when it has one,
+    #    otherwise stream slices of a memory map
+    response.content_length = end - start
+    response.direct_passthrough = True
+    if request.method != 'HEAD' and end > start:
+        response.response = _file_body(info.path, start, end)
+    return response
+
+
+def _use_accel_redirect(index):
+    # Only when enabled, mapped, and nginx says it is in front (it sets
+    # X-Sendfile-Type on proxied requests, see nginx.conf)
+    return (index.accel_prefix is not None
+            and current_app.config.get('USE_X_ACCEL_REDIRECT', False)
+            and request.headers.get('X-Sendfile-Type') == 'X-Accel-Redirect')
+
+
+def _if_range_matches(info):
+    if 'If-Range' not in request.headers:
+        return True
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == info.etag
+    return if_range.date is not None and if_range.date == info.last_modified
+
+
+def _file_body(path, start, end):
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        # The server sends from the current offset up to Content-Length
+        f = open(path, 'rb')
+        f.seek(start)
+        return file_wrapper(f, CHUNK_SIZE)
+    return _mmap_chunks(path, start, end)
+
+
+def _mmap_chunks(path, start, end):
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(start, end, CHUNK_SIZE):
+                yield mapped[offset:min(offset + CHUNK_SIZE, end)]
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
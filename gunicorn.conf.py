@@ -0,0 +1,55 @@
+"""
+Gunicorn settings for production serving
+
+    gunicorn --config gunicorn.conf.py app:app
+
+Local development keeps using ``python app.py``. Every setting can be
+overridden from the environment (see docker-compose.yml).
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Preforked worker processes, each running a pool of request threads
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+
+# Import the app and warm it up once in the master, then fork: workers
+# share the loaded code and templates copy-on-write
+preload_app = True
+
+# Recycle each worker after this many requests (plus jitter so they don't
+# all restart at once) to cap any slow memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Requests in flight get this long to finish on shutdown or reload
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+# Reloads: `kill -HUP <master>` replaces the workers gracefully with new
+# config. Because the app is preloaded, picking up new *code* needs
+# `kill -USR2 <master>` (starts a new master alongside the old one) and then
+# `kill -TERM <old master>` once the new one is serving.
+
+
+def when_ready(server):
+    from app import preload
+    from DAL import closeAllConnections
+    preload()
+    # Fork with no database handles open in the master
+    closeAllConnections()
+
+
+def post_fork(server, worker):
+    # SQLite connections must never cross a fork; each worker opens its own.
+    # Anything inherited belongs to the master, so forget it, don't close it
+    from DAL import forgetConnections
+    forgetConnections()
@@ -0,0 +1,225 @@
+"""
+Resized, content-hashed image variants for the files in static/images
+
+Run ``python images.py`` at build time to generate every variant up front;
+uploads get theirs when they are saved. Pages only look variants up, so a
+missing one never holds up a render; a ``?w=`` request for one generates it.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import url_for
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it pages use the originals
+    Image = None
+
+# Widths (in px) generated for every source image that is wider than them
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+
+# (file extension, Pillow format, mimetype) for each generated format
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+)
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+VARIANTS_DIRNAME = '_variants'
+MANIFEST_NAME = 'manifest.json'
+
+# Source files whose variants are remembered between revalidations; the
+# least recently used are forgotten beyond this
+MAX_CHECKED = 1024
+
+
+class ImageVariants:
+    """Generate and look up downscaled variants of the images in a directory.
+
+    Variants are written to ``<source_dir>/_variants`` under names that
+    include a hash of their bytes (``headshot-320w.1a2b3c4d.webp``), so they
+    can be served with immutable cache headers. A manifest in the same
+    directory maps each source file (by size and mtime) to its variants and
+    is shared by every worker process.
+    """
+
+    def __init__(self, source_dir, widths=VARIANT_WIDTHS, quality=80, revalidate_interval=2.0):
+        self.source_dir = source_dir
+        self.output_dir = os.path.join(source_dir, VARIANTS_DIRNAME)
+        self.widths = widths
+        self.quality = quality
+        self.revalidate_interval = revalidate_interval
+        self._manifest = None
+        self._manifest_checked = 0.0
+        self._manifest_mtime = None
+        self._checked = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def variants(self, filename, generate=True):
+        """Return the variants of ``filename`` as dicts of name, width, ext and mimetype.
+
+        Missing or outdated variants are generated unless ``generate`` is
+        False, in which case the lookup returns an empty list until they
+        exist. Returns an empty list for files that don't exist (e.g. the
+        placeholder image) or can't be resized.
+        """
+        if not self.enabled or not filename.lower().endswith(SOURCE_EXTENSIONS):
+            return []
+
+        # Don't stat the source on every lookup
+        checked = self._checked.get(filename)
+        if checked is not None and time.monotonic() - checked[0] < self.revalidate_interval:
+            return checked[1]
+
+        # The name comes from the URL: it must not reach outside the source
+        # directory, and names that don't exist are never remembered
+        source = safe_join(self.source_dir, filename)
+        if source is None:
+            return []
+        try:
+            stat = os.stat(source)
+        except OSError:
+            return []
+
+        with self._lock:
+            variants = self._variants_for(source, filename, stat, generate)
+            if variants is None:
+                return []
+            self._checked[filename] = (time.monotonic(), variants)
+            self._checked.move_to_end(filename)
+            while len(self._checked) > MAX_CHECKED:
+                self._checked.popitem(last=False)
+        return variants
+
+    def srcset(self, filename, ext='jpg'):
+        """Return a srcset attribute value for one format of ``filename``."""
+        return ', '.join(
+            f"{url_for('serve_image', filename=VARIANTS_DIRNAME + '/' + variant['name'])} {variant['width']}w"
+            for variant in self.variants(filename, generate=False) if variant['ext'] == ext
+        )
+
+    def best(self, filename, width, accept_webp=False):
+        """Return the name of the smallest variant at least ``width`` px wide, or None."""
+        candidates = [variant for variant in self.variants(filename)
+                      if variant['ext'] == ('webp' if accept_webp else 'jpg')]
+        for variant in sorted(candidates, key=lambda v: v['width']):
+            if variant['width'] >= width:
+                return VARIANTS_DIRNAME + '/' + variant['name']
+        # Asked for something wider than every variant: the original is best
+        return None
+
+    def build_all(self):
+        """Generate variants for every image in the source directory."""
+        built = {}
+        for name in sorted(os.listdir(self.source_dir)):
+            if os.path.isfile(os.path.join(self.source_dir, name)):
+                built[name] = self.variants(name)
+        return built
+
+    def _variants_for(self, source, filename, stat, generate):
+        # Called with self._lock held. Returns None when the variants are
+        # out of date and ``generate`` is off
+
+        # A. Reuse what's on disk if the source hasn't changed since
+        manifest = self._load_manifest()
+        entry = manifest.get(filename)
+        if (entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns
+                and all(os.path.exists(os.path.join(self.output_dir, v['name'])) for v in entry['variants'])):
+            return entry['variants']
+        if not generate:
+            return None
+
+        # B. Otherwise generate them and record them in the manifest
+        try:
+            variants = self._generate(source, filename)
+        except OSError:
+            variants = []
+        manifest[filename] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'variants': variants}
+        self._save_manifest(manifest)
+        return variants
+
+    def _generate(self, source, filename):
+        # Every path component is sanitized, so the variants always land
+        # inside output_dir whatever the source filename was
+        parts = os.path.splitext(filename)[0].replace(' ', '-').split('/')
+        stem = '/'.join(secure_filename(part) or 'image' for part in parts)
+        # Images in subdirectories (uploads/) get their variants in the same one
+        os.makedirs(os.path.dirname(os.path.join(self.output_dir, stem)), exist_ok=True)
+        variants = []
+
+        with Image.open(source) as original:
+            original_width, original_height = original.size
+            image = original.convert('RGB')
+
+        for width in self.widths:
+            # Never upscale
+            if width >= original_width:
+                break
+            height = round(original_height * width / original_width)
+            resized = image.resize((width, height), Image.LANCZOS)
+
+            for ext, image_format, mimetype in VARIANT_FORMATS:
+                buffer = io.BytesIO()
+                resized.save(buffer, image_format, quality=self.quality, optimize=True)
+                data = buffer.getvalue()
+                name = f'{stem}-{width}w.{hashlib.sha256(data).hexdigest()[:12]}.{ext}'
+                _write_atomic(os.path.join(self.output_dir, name), data)
+                variants.append({'name': name, 'width': width, 'ext': ext, 'mimetype': mimetype})
+
+        return variants
+
+    def _load_manifest(self):
+        # Another worker may have added entries: look at the file at most
+        # once per revalidate_interval, and only parse it again if it changed
+        now = time.monotonic()
+        if self._manifest is not None and now - self._manifest_checked < self.revalidate_interval:
+            return self._manifest
+        self._manifest_checked = now
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if self._manifest is None or mtime != self._manifest_mtime:
+                with open(path) as f:
+                    self._manifest = json.load(f)
+                self._manifest_mtime = mtime
+        except (OSError, ValueError):
+            self._manifest = self._manifest or {}
+        return self._manifest
+
+    def _save_manifest(self, manifest):
+        # Re-read the file first so entries other workers wrote since our
+        # last load aren't lost
+        self._manifest_checked = 0.0
+        manifest = dict(self._load_manifest(), **manifest)
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        _write_atomic(path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+        self._manifest = manifest
+        self._manifest_mtime = os.stat(path).st_mtime_ns
+
+
+def _write_atomic(path, data):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+if __name__ == '__main__':
+    if Image is None:
+        print("Pillow is not installed; skipping image variants.")
+    else:
+        pipeline = ImageVariants(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images'))
+        for source, variants in pipeline.build_all().items():
+            print(f"{source}: {len(variants)} variants")
@@ -0,0 +1,211 @@
+"""
+Prometheus-style metrics for requests and DAL queries, kept in process memory
+
+Each gunicorn worker keeps its own counters, so a scrape of /metrics shows
+the worker that answered it; the ``pid`` in ``process_info`` tells them apart.
+"""
+import functools
+import inspect
+import os
+import threading
+import time
+
+from flask import g, request
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and a tuple of label pairs."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def add_collector(self, collector):
+        """Register a callable returning (name, kind, help, labels, value) samples at scrape time."""
+        self._collectors.append(collector)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                help_kind, text = self._help.get(name, (kind, name))
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {help_kind}')
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{_labels(labels)} {value}')
+
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        for collector in self._collectors:
+            for name, kind, text, labels, value in collector():
+                if name not in self._help:
+                    self._help[name] = (kind, text)
+                header(name, kind)
+                lines.append(f'{name}{_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'counter', 'HTTP requests by endpoint, method and status code.')
+registry.describe('http_request_duration_seconds', 'histogram', 'Time from request start until the view returned, by endpoint.')
+registry.describe('dal_query_duration_seconds', 'histogram', 'Time spent in each DAL function.')
+registry.describe('dal_query_rows_total', 'counter', 'Rows returned or written by each DAL function.')
+registry.describe('dal_query_errors_total', 'counter', 'DAL calls that raised, by function.')
+registry.add_collector(lambda: [('process_info', 'gauge', 'Worker process serving this scrape.', (('pid', os.getpid()),), 1)])
+
+
+#######################################################
+# DAL QUERY TIMING
+#######################################################
+def timed_query(function=None, *, rows=None):
+    """Record duration, row count and errors for a DAL function.
+
+    Generator functions are timed until the caller finishes iterating, and
+    their rows are counted as they are yielded. ``rows`` overrides how the
+    row count is read from a return value (e.g. for a function returning an id).
+    """
+    if function is None:
+        return functools.partial(timed_query, rows=rows)
+
+    labels = (('function', function.__name__),)
+    count_rows = rows or _row_count
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            rows = 0
+            try:
+                for item in function(*args, **kwargs):
+                    rows += 1
+                    yield item
+            except Exception:
+                registry.inc('dal_query_errors_total', labels)
+                raise
+            finally:
+                registry.observe('dal_query_duration_seconds', labels, time.perf_counter() - start)
+                registry.inc('dal_query_rows_total', labels, rows)
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            registry.inc('dal_query_errors_total', labels)
+            raise
+        finally:
+            registry.observe('dal_query_duration_seconds', labels, time.perf_counter() - start)
+        registry.inc('dal_query_rows_total', labels, count_rows(result))
+        return result
+    return wrapper
+
+
+def _row_count(result):
+    # bool before int: True/False mean one row changed or none
+    if result is None:
+        return 0
+    if isinstance(result, bool):
+        return int(result)
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict):
+        return 1
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        # (page, next cursor)
+        return len(result[0])
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+#######################################################
+# REQUEST TIMING
+#######################################################
+class RequestMetrics:
+    """Count requests and time them per Flask endpoint."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start_timer)
+        app.after_request(self._record)
+
+    def _start_timer(self):
+        g._metrics_start = time.perf_counter()
+
+    def _record(self, response):
+        start = g.pop('_metrics_start', None)
+        endpoint = request.endpoint or 'unmatched'
+        registry.inc('http_requests_total', (('endpoint', endpoint), ('method', request.method),
+                                             ('status', str(response.status_code))))
+        if start is not None:
+            registry.observe('http_request_duration_seconds', (('endpoint', endpoint), ('method', request.method)),
+                             time.perf_counter() - start)
+        return response
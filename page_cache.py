@@ -0,0 +1,106 @@
+"""
+In-memory cache for pages whose HTML only changes when their templates do
+"""
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate
+
+from flask import current_app, render_template, request
+from jinja2 import meta
+
+
+class PageCache:
+    """Render a template once and serve the bytes from memory.
+
+    Each entry remembers the modification time of the template and of every
+    template it extends or includes; when any of them changes on disk the
+    page is rendered again. Responses carry a strong ETag, Last-Modified and
+    Cache-Control, and a matching If-None-Match gets a 304 without touching
+    Jinja.
+    """
+
+    def __init__(self, app=None, max_age=300, check_interval=1.0):
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['page_cache'] = self
+
+    def page(self, template_name, status=200):
+        """Return a response for ``template_name`` from the cache."""
+        entry = self._get_entry(template_name)
+
+        response = current_app.response_class(entry['body'], status=status,
+                                              mimetype='text/html')
+        # Error pages must not be revalidated into a 304
+        if status != 200:
+            return response
+
+        response.set_etag(entry['etag'])
+        response.headers['Last-Modified'] = entry['last_modified']
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get_entry(self, template_name):
+        entry = self._entries.get(template_name)
+        if entry is not None and not self._is_stale(entry):
+            return entry
+
+        with self._lock:
+            # Another thread may have rendered it while we waited
+            entry = self._entries.get(template_name)
+            if entry is None or self._is_stale(entry):
+                entry = self._render(template_name)
+                self._entries[template_name] = entry
+        return entry
+
+    def _is_stale(self, entry):
+        now = time.monotonic()
+        if now - entry['checked_at'] < self.check_interval:
+            return False
+        entry['checked_at'] = now
+        return _mtimes(entry['files']) != entry['mtimes']
+
+    def _render(self, template_name):
+        files = _template_files(current_app.jinja_env, template_name)
+        mtimes = _mtimes(files)
+        body = render_template(template_name).encode('utf-8')
+        return {
+            'body': body,
+            'etag': hashlib.sha256(body).hexdigest()[:32],
+            'last_modified': formatdate(max(mtimes), usegmt=True),
+            'files': files,
+            'mtimes': mtimes,
+            'checked_at': time.monotonic(),
+        }
+
+
+def _template_files(env, template_name, seen=None):
+    """Return the source files of a template and everything it pulls in."""
+    if seen is None:
+        seen = {}
+    if template_name in seen:
+        return list(seen.values())
+
+    source, filename, _ = env.loader.get_source(env, template_name)
+    seen[template_name] = filename
+    for parent in meta.find_referenced_templates(env.parse(source)):
+        # Dynamic names (None) can't be resolved ahead of time
+        if parent is not None:
+            _template_files(env, parent, seen)
+    return list(seen.values())
+
+
+def _mtimes(files):
+    return tuple(os.stat(filename).st_mtime for filename in files)
@@ -0,0 +1,159 @@
+"""
+On-demand cProfile of requests, written per endpoint as pstats and collapsed stacks
+
+A request is profiled when it carries ``X-Profile: <PROFILE_TOKEN>`` (the
+header is ignored while no token is configured) or when it falls in the
+random ``PROFILE_SAMPLE_RATE`` fraction of requests. The profiler runs
+from before_request until the response has been sent, so a streamed body
+(e.g. /projects) is part of the profile. Two files land in
+``PROFILE_DIR/<endpoint>/``:
+
+* ``<stamp>.pstats`` -- load with ``python -m pstats`` or snakeviz
+* ``<stamp>.collapsed`` -- one ``frame;frame;frame microseconds`` line per
+  call path, for flamegraph.pl or speedscope
+
+cProfile only records caller/callee pairs, so the collapsed stacks split
+each function's time between its callers in proportion. It profiles the
+request's own thread: for writes, the time spent on the DAL's writer
+thread shows up as waiting (the slow-query log in DAL.py covers the SQL
+itself).
+"""
+import cProfile
+import hmac
+import itertools
+import os
+import pstats
+import random
+import time
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile'
+
+# Newest profiles kept per endpoint; older ones are deleted
+MAX_PROFILES_PER_ENDPOINT = 50
+
+# Call paths taking less than this many seconds are left out of the
+# collapsed stacks, and stacks are cut at this depth
+MIN_PATH_SECONDS = 1e-5
+MAX_STACK_DEPTH = 128
+
+# Tells apart profiles started in the same second by one process
+_sequence = itertools.count()
+
+
+class RequestProfiler:
+    """Profile sampled or explicitly requested requests with cProfile."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_TOKEN', None)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.root_path, 'profiles'))
+        self.app = app
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _wanted(self):
+        token = self.app.config['PROFILE_TOKEN']
+        header = request.headers.get(PROFILE_HEADER)
+        if token and header and hmac.compare_digest(header.encode(), token.encode()):
+            return True
+        rate = self.app.config['PROFILE_SAMPLE_RATE']
+        return rate > 0 and random.random() < rate
+
+    def _start(self):
+        if request.endpoint is None or not self._wanted():
+            return
+        profiler = cProfile.Profile()
+        g._profile = (profiler, time.time())
+        profiler.enable()
+
+    def _finish(self, response):
+        started = g.pop('_profile', None)
+        if started is None:
+            return response
+        profiler, started_at = started
+
+        # Stop once the body has been sent, then write the files
+        endpoint = request.endpoint
+        stamp = f'{time.strftime("%Y%m%dT%H%M%S", time.gmtime(started_at))}-{os.getpid()}-{next(_sequence)}'
+        directory = os.path.join(self.app.config['PROFILE_DIR'], endpoint)
+
+        def write():
+            profiler.disable()
+            try:
+                write_profile(profiler, directory, stamp)
+            except OSError as e:
+                print(f"Could not write profile for {endpoint}: {e}")
+
+        response.call_on_close(write)
+        response.headers['X-Profile-Id'] = f'{endpoint}/{stamp}'
+        return response
+
+
+def write_profile(profiler, directory, stamp):
+    """Write ``<stamp>.pstats`` and ``<stamp>.collapsed`` and prune old profiles."""
+    os.makedirs(directory, exist_ok=True)
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(os.path.join(directory, f'{stamp}.pstats'))
+    with open(os.path.join(directory, f'{stamp}.collapsed'), 'w') as f:
+        for stack, microseconds in collapsed_stacks(stats):
+            f.write(f'{stack} {microseconds}\n')
+
+    # Keep the newest MAX_PROFILES_PER_ENDPOINT (stamps sort by time)
+    stamps = sorted({name.rsplit('.', 1)[0] for name in os.listdir(directory)})
+    for old in stamps[:-MAX_PROFILES_PER_ENDPOINT]:
+        for extension in ('pstats', 'collapsed'):
+            try:
+                os.remove(os.path.join(directory, f'{old}.{extension}'))
+            except FileNotFoundError:
+                pass
+
+
+def collapsed_stacks(stats):
+    """Yield (``a;b;c``, self microseconds) for each call path in ``stats``."""
+    # pstats: func -> (primitive calls, calls, self time, cumulative time, callers)
+    table = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in table.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    totals = {}
+
+    def walk(func, stack, share):
+        # ``share`` is the part of func's time spent on this path
+        _, _, self_time, cumulative, _ = table[func]
+        path = stack + (_label(func),)
+        totals[';'.join(path)] = totals.get(';'.join(path), 0) + self_time * share
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_cumulative in callees.get(func, ()):
+            callee_cumulative = table[callee][3]
+            if callee_cumulative <= 0 or _label(callee) in path:
+                continue
+            child_share = min(1.0, edge_cumulative * share / callee_cumulative)
+            if callee_cumulative * child_share >= MIN_PATH_SECONDS:
+                walk(callee, path, child_share)
+
+    # Roots: functions nothing profiled called (the frames the profiler started in)
+    for func, (_, _, _, _, callers) in table.items():
+        if not callers:
+            walk(func, (), 1.0)
+
+    for stack, seconds in sorted(totals.items()):
+        microseconds = round(seconds * 1e6)
+        if microseconds > 0:
+            yield stack, microseconds
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        # builtins, e.g. <method 'execute' of 'sqlite3.Cursor' objects>
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
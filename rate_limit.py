@@ -0,0 +1,133 @@
+"""
+Per-client token-bucket rate limits and backpressure for the write routes
+
+Views tagged with ``@rate_limiter.limit(per_minute, burst)`` get one token
+bucket per client IP: each request takes a token, tokens come back at
+``per_minute`` / 60 per second, and at most ``burst`` are saved up. A
+client with an empty bucket is answered 429 with ``Retry-After`` before the
+view runs. Buckets are updated in O(1) and dropped once they have been idle
+long enough to be full again, so memory follows the number of active
+clients.
+
+``overloaded`` is checked first: while it returns True (e.g. the DAL's
+write queue is backed up) every request to the view gets a fast 503 with
+``Retry-After`` instead of queueing behind the writer.
+
+The client IP is ``request.remote_addr``; behind nginx the app is wrapped
+in ProxyFix so that is the address nginx put in ``X-Forwarded-For``.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+from metrics import registry
+
+# Clients tracked per route; the least recently seen are dropped beyond this
+MAX_CLIENTS = 10000
+
+# Retry-After (seconds) sent while a view is overloaded
+OVERLOADED_RETRY_AFTER = 1
+
+registry.describe('http_requests_limited_total', 'counter',
+                  'Requests refused before the view ran, by endpoint and reason.')
+
+
+class TokenBucket:
+    """Tokens left for one client, as of ``updated`` (time.monotonic)."""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RouteLimit:
+    """The limit for one view and the buckets of the clients calling it."""
+
+    def __init__(self, per_minute, burst, overloaded=None):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.overloaded = overloaded
+        # Seconds after which an untouched bucket is full again
+        self.idle_after = burst / self.rate
+        self.buckets = OrderedDict()
+
+    def take(self, client, now):
+        """Take a token for ``client``; returns 0 or the seconds until one is available."""
+        # A. Forget clients whose buckets have refilled. Buckets are kept in
+        #    order of last use, so only the front ever needs looking at
+        buckets = self.buckets
+        while buckets:
+            oldest = next(iter(buckets.values()))
+            if now - oldest.updated < self.idle_after and len(buckets) < MAX_CLIENTS:
+                break
+            buckets.popitem(last=False)
+
+        # B. Refill for the time since the last request, then spend a token
+        bucket = buckets.get(client)
+        if bucket is None:
+            bucket = buckets[client] = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            buckets.move_to_end(client)
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0
+        return (1 - bucket.tokens) / self.rate
+
+
+class RateLimiter:
+    """Refuse requests to limited views from clients that are over their rate."""
+
+    def __init__(self, app=None):
+        self._limits = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMITS_ENABLED', True)
+        app.before_request(self.before_request)
+
+    def limit(self, per_minute, burst, overloaded=None):
+        """Allow each client ``per_minute`` requests to this view, ``burst`` at once."""
+        def decorator(view):
+            self._limits[view.__name__] = RouteLimit(per_minute, burst, overloaded)
+            return view
+        return decorator
+
+    def before_request(self):
+        route = self._limits.get(request.endpoint)
+        if route is None or not current_app.config['RATE_LIMITS_ENABLED']:
+            return None
+
+        # A. Shed load while the backend is backed up, whoever is asking
+        if route.overloaded is not None and route.overloaded():
+            self._refused('overloaded')
+            raise ServiceUnavailable("The site is busy saving other changes. Please try again in a moment.",
+                                     retry_after=OVERLOADED_RETRY_AFTER)
+
+        # B. Otherwise spend one of this client's tokens
+        with self._lock:
+            wait = route.take(request.remote_addr or '', time.monotonic())
+        if wait:
+            self._refused('rate_limited')
+            raise TooManyRequests("Too many requests. Please slow down and try again shortly.",
+                                  retry_after=math.ceil(wait))
+        return None
+
+    def clear(self):
+        """Forget every client's bucket."""
+        with self._lock:
+            for route in self._limits.values():
+                route.buckets.clear()
+
+    def _refused(self, reason):
+        registry.inc('http_requests_limited_total', (('endpoint', request.endpoint), ('reason', reason)))
@@ -121,6 +121,774 @@ class TestDatabase:
         assert True  # Placeholder for validation tests
 
 
+class DALTestCase:
+    """Base class that runs the real DAL functions against a throwaway database"""
+
+    def setup_method(self):
+        """Point the DAL at a fresh test database"""
+        import DAL
+        self.dal = DAL
+        self.original_path = DAL.DB_PATH
+        # Next to the session's database (see conftest.py), never the real one
+        self.test_db = os.path.join(os.path.dirname(os.path.abspath(DAL.DB_PATH)), "test_dal.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+        DAL.closeAllConnections()
+        DAL.DB_PATH = self.test_db
+        DAL.createDatabase()
+
+    def teardown_method(self):
+        """Restore the DAL and remove the test database"""
+        self.dal.closeAllConnections()
+        self.dal.DB_PATH = self.original_path
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.test_db + suffix):
+                os.remove(self.test_db + suffix)
+
+
+class TestMigrations(DALTestCase):
+    """Test class for the versioned schema migrations"""
+
+    def test_fresh_database_is_current(self):
+        """Test that every migration ran once and was logged with its timing"""
+        assert self.dal.getSchemaVersion() == len(self.dal.MIGRATIONS)
+        with self.dal.getConnection() as conn:
+            logged = conn.execute("SELECT version, name, duration_ms FROM schema_migrations ORDER BY version").fetchall()
+        assert [row[0] for row in logged] == list(range(1, len(self.dal.MIGRATIONS) + 1))
+        assert [row[1] for row in logged] == [m.__name__ for m in self.dal.MIGRATIONS]
+        assert all(row[2] >= 0 for row in logged)
+
+    def test_current_database_applies_nothing(self):
+        """Test that a second run only reads the schema version"""
+        statements = []
+        with self.dal.getConnection() as conn:
+            conn.set_trace_callback(statements.append)
+        try:
+            assert self.dal.createDatabase() == []
+        finally:
+            with self.dal.getConnection() as conn:
+                conn.set_trace_callback(None)
+        assert statements == ["PRAGMA user_version"]
+
+    def test_only_pending_migrations_run(self):
+        """Test that a database at an older version gets just the newer steps"""
+        with self.dal.getConnection() as conn:
+            with conn:
+                conn.execute("DROP INDEX projects_created")
+                conn.execute("PRAGMA user_version = 4")
+                conn.execute("DELETE FROM schema_migrations WHERE version >= 5")
+        applied = self.dal.createDatabase()
+        assert [version for version, _, _ in applied] == list(range(5, len(self.dal.MIGRATIONS) + 1))
+        assert applied[0][1] == "_createListingIndexes"
+        assert self.dal.getSchemaVersion() == len(self.dal.MIGRATIONS)
+
+    def test_no_statistics_are_kept(self):
+        """Test that stats gathered on an empty database are removed and never recreated"""
+        with self.dal.getConnection() as conn:
+            with conn:
+                conn.execute("ANALYZE")
+                assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+                conn.execute("PRAGMA user_version = 6")
+                conn.execute("DELETE FROM schema_migrations WHERE version >= 7")
+        applied = self.dal.createDatabase()
+        assert [name for _, name, _ in applied][0] == "_dropStaleStatistics"
+        with self.dal.getConnection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] == 0
+
+    def test_change_counter_tracks_every_write(self):
+        """Test that inserts, updates, deletes and bulk imports all bump the projects version"""
+        import sqlite3
+        versions = [self.dal.getProjectsVersion()]
+        new_id = self.dal.saveProjectDB("Versioned", "D", "")
+        versions.append(self.dal.getProjectsVersion())
+        self.dal.updateProjectById(new_id, "Renamed", "D", "")
+        versions.append(self.dal.getProjectsVersion())
+        self.dal.bulkSaveProjects([("A", "D", ""), ("B", "D", "")])
+        versions.append(self.dal.getProjectsVersion())
+        self.dal.deleteProjectById(new_id)
+        versions.append(self.dal.getProjectsVersion())
+        assert versions == sorted(set(versions))
+
+        # A write from another connection (e.g. another worker) is seen too
+        other = sqlite3.connect(self.test_db)
+        with other:
+            other.execute("DELETE FROM projects")
+        other.close()
+        assert self.dal.getProjectsVersion() > versions[-1]
+
+    def test_date_ordered_listing_uses_index(self):
+        """Test that listing by CreatedDate walks the index instead of sorting"""
+        with self.dal.getConnection() as conn:
+            plan = " ".join(row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id, Title FROM projects ORDER BY CreatedDate DESC, id DESC LIMIT 10"))
+        assert "projects_created" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+class TestDatabaseConfig(DALTestCase):
+    """Test class for the environment-driven connection tuning and WAL checkpoints"""
+
+    def test_tests_use_a_throwaway_database(self):
+        """Test that the session database is not the working-directory projects.db"""
+        assert os.path.abspath(self.original_path) != os.path.abspath("projects.db")
+
+    def test_env_number(self, monkeypatch):
+        """Test that tuning values are read from the environment with defaults"""
+        monkeypatch.setenv("DB_MMAP_SIZE", "1048576")
+        assert self.dal._envNumber("DB_MMAP_SIZE", 0) == 1048576
+        monkeypatch.delenv("DB_CHECKPOINT_INTERVAL", raising=False)
+        assert self.dal._envNumber("DB_CHECKPOINT_INTERVAL", 30.0, float) == 30.0
+
+    def test_every_connection_is_tuned(self):
+        """Test that pooled and watcher connections carry the configured pragmas"""
+        self.dal.getProjectsVersion()
+        with self.dal.getConnection() as conn:
+            pooled = [conn.execute(f"PRAGMA {name}").fetchone()[0]
+                      for name in ("mmap_size", "wal_autocheckpoint", "journal_size_limit", "journal_mode")]
+        assert pooled == [self.dal.MMAP_SIZE, self.dal.WAL_AUTOCHECKPOINT, self.dal.JOURNAL_SIZE_LIMIT, "wal"]
+        assert self.dal._cacheWatcher.execute("PRAGMA mmap_size").fetchone()[0] == self.dal.MMAP_SIZE
+
+    def test_page_size_applies_to_new_databases(self):
+        """Test that a new file is created with DB_PAGE_SIZE"""
+        original = self.dal.DB_PAGE_SIZE
+        self.dal.closeAllConnections()
+        os.remove(self.test_db)
+        self.dal.DB_PAGE_SIZE = 8192
+        try:
+            self.dal.createDatabase()
+            with self.dal.getConnection() as conn:
+                assert conn.execute("PRAGMA page_size").fetchone()[0] == 8192
+        finally:
+            self.dal.DB_PAGE_SIZE = original
+
+    def test_create_database_makes_the_data_directory(self):
+        """Test that createDatabase creates a missing parent directory"""
+        directory = os.path.join(os.path.dirname(self.test_db), "fresh-volume")
+        self.dal.closeAllConnections()
+        self.dal.DB_PATH = os.path.join(directory, "projects.db")
+        try:
+            self.dal.createDatabase()
+            assert os.path.exists(self.dal.DB_PATH)
+        finally:
+            self.dal.closeAllConnections()
+            self.dal.DB_PATH = self.test_db
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def test_checkpointer_waits_for_the_first_write(self, monkeypatch):
+        """Test that connecting and reading (as gunicorn's master does) starts no checkpointer"""
+        started = []
+        monkeypatch.setattr(self.dal, "_checkpointer", lambda: started.append(os.getpid()))
+        self.dal.closeAllConnections()
+        self.dal.createDatabase()
+        self.dal.getAllProjects()
+        assert started == []
+        self.dal.bulkSaveProjects([("Title", "Description", "")])
+        assert started == [os.getpid()]
+
+    def test_forget_connections_leaves_inherited_handles_open(self):
+        """Test that a forked child drops the pool without closing the parent's connections"""
+        with self.dal.getConnection() as inherited:
+            pass
+        self.dal.getProjectsVersion()
+        self.dal.forgetConnections()
+        try:
+            assert self.dal._cacheWatcher is None
+            assert inherited.execute("SELECT 1").fetchone()[0] == 1
+            with self.dal.getConnection() as conn:
+                assert conn is not inherited
+        finally:
+            inherited.close()
+
+    def test_checkpoint_folds_the_wal_back(self):
+        """Test that a checkpoint copies every WAL frame into the database"""
+        self.dal.bulkSaveProjects(("Title", "Description " * 50, "") for _ in range(500))
+        busy, frames, checkpointed = self.dal.checkpointDatabase()
+        assert busy == 0
+        assert frames == checkpointed
+        self.dal.checkpointDatabase("TRUNCATE")
+        assert os.path.getsize(self.test_db + "-wal") == 0
+
+        with pytest.raises(ValueError):
+            self.dal.checkpointDatabase("SOMETIMES")
+
+
+class TestSlowQueryLog(DALTestCase):
+    """Test class for the DAL slow-query log"""
+
+    def setup_method(self):
+        """Log every statement"""
+        super().setup_method()
+        self.threshold = self.dal.SLOW_QUERY_MS
+        self.dal.SLOW_QUERY_MS = 1e-9
+        self.dal._slowQueries.clear()
+
+    def teardown_method(self):
+        """Restore the threshold"""
+        self.dal.SLOW_QUERY_MS = self.threshold
+        super().teardown_method()
+
+    def test_slow_reads_are_logged_with_plan_and_shape(self):
+        """Test that a logged read carries its SQL, parameter shape and query plan"""
+        project_id = self.dal.saveProjectDB("Slow", "Description", "")
+        self.dal.invalidateCache()
+        self.dal._slowQueries.clear()
+        self.dal.getProjectById(project_id)
+
+        entry = [e for e in self.dal.getSlowQueries() if "FROM projects WHERE id = ?" in e["sql"]][0]
+        assert entry["parameters"] == ["int"]
+        assert entry["ms"] >= 0
+        assert any("projects" in step for step in entry["plan"])
+
+    def test_parameter_values_are_never_logged(self):
+        """Test that only the types and sizes of parameters are recorded"""
+        self.dal.saveContacts([("Ada", "Lovelace", "ada@example.com", "scrypt$secret", "Hi")])
+        entry = [e for e in self.dal.getSlowQueries() if e["sql"].startswith("INSERT INTO contacts")][0]
+        assert entry["executemany"]
+        assert entry["parameters"] == ["str[3]", "str[8]", "str[15]", "str[13]", "str[2]"]
+        assert "secret" not in repr(self.dal.getSlowQueries())
+
+        self.dal.saveProjectDB("Title", "Private text", "")
+        entry = [e for e in self.dal.getSlowQueries() if e["sql"].startswith("INSERT INTO projects")][0]
+        assert entry["parameters"] == ["str[5]", "str[12]", "str[0]"]
+
+    def test_executemany_is_planned_with_its_first_row(self):
+        """Test that an executemany gets the query plan of its first parameter row"""
+        self.dal.bulkSaveProjects([("A", "D", ""), ("B", "D", "")])
+        self.dal._slowQueries.clear()
+        with self.dal.getConnection() as conn, conn:
+            conn.executemany("UPDATE projects SET Title = ? WHERE id = ?", ((f"T{n}", n) for n in (1, 2)))
+        assert [p["Title"] for p in self.dal.getAllProjects()] == ["T1", "T2"]
+
+        entry = [e for e in self.dal.getSlowQueries() if e["sql"].startswith("UPDATE projects")][0]
+        assert entry["executemany"] and entry["parameters"] == ["str[2]", "int"]
+        assert any("projects" in step for step in entry["plan"])
+
+    def test_threshold_zero_turns_the_log_off(self):
+        """Test that nothing is logged with the threshold at 0"""
+        self.dal.SLOW_QUERY_MS = 0
+        self.dal.getAllProjects()
+        assert self.dal.getSlowQueries() == []
+
+
+class TestConnectionPool(DALTestCase):
+    """Test class for the pooled DAL connections"""
+
+    def test_connection_is_reused(self):
+        """Test that a released connection is handed out again"""
+        with self.dal.getConnection() as first:
+            pass
+        with self.dal.getConnection() as second:
+            pass
+        assert first is second
+
+    def test_connection_pragmas(self):
+        """Test that pooled connections are tuned for WAL"""
+        with self.dal.getConnection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            # NORMAL == 1
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+    def test_failed_transaction_is_rolled_back(self):
+        """Test that a connection is returned to the pool without an open transaction"""
+        with pytest.raises(RuntimeError):
+            with self.dal.getConnection() as conn:
+                conn.execute("INSERT INTO projects (Title, Description) VALUES ('x', 'y')")
+                raise RuntimeError("boom")
+        with self.dal.getConnection() as conn:
+            assert not conn.in_transaction
+            assert conn.execute("SELECT COUNT(*) FROM projects").fetchone()[0] == 0
+
+    def test_crud_round_trip(self):
+        """Test the DAL functions against the pooled connections"""
+        self.dal.saveProjectDB("Pool Project", "Pool Description", "")
+        projects = self.dal.getAllProjects()
+        assert len(projects) == 1
+        assert projects[0]["Image"] == "placeholder.png"
+
+        project_id = projects[0]["id"]
+        assert self.dal.updateProjectById(project_id, "Renamed", "Pool Description", "pool.jpg")
+        assert self.dal.getProjectById(project_id)["Title"] == "Renamed"
+        assert self.dal.deleteProjectById(project_id)
+        assert self.dal.getProjectById(project_id) is None
+
+    def test_close_all_connections(self):
+        """Test that closing the pool closes every connection"""
+        with self.dal.getConnection() as conn:
+            pass
+        self.dal.closeAllConnections()
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+class TestPagination(DALTestCase):
+    """Test class for keyset pagination in the DAL"""
+
+    def test_iter_projects_in_id_order(self):
+        """Test that iterProjects yields every project in id order"""
+        for number in range(5):
+            self.dal.saveProjectDB(f"Project {number}", "Description", "")
+        ids = [project["id"] for project in self.dal.iterProjects()]
+        assert ids == sorted(ids)
+        assert len(ids) == 5
+
+    def test_get_projects_page(self):
+        """Test that pages follow each other through the keyset cursor"""
+        for number in range(5):
+            self.dal.saveProjectDB(f"Project {number}", "Description", "")
+
+        first, next_after = self.dal.getProjectsPage(limit=2)
+        assert [p["Title"] for p in first] == ["Project 0", "Project 1"]
+        assert next_after == first[-1]["id"]
+
+        second, next_after = self.dal.getProjectsPage(after=next_after, limit=2)
+        assert [p["Title"] for p in second] == ["Project 2", "Project 3"]
+
+        last, next_after = self.dal.getProjectsPage(after=next_after, limit=2)
+        assert [p["Title"] for p in last] == ["Project 4"]
+        assert next_after is None
+
+    def test_get_projects_page_exact_fit(self):
+        """Test that a full last page does not report a next page"""
+        for number in range(2):
+            self.dal.saveProjectDB(f"Project {number}", "Description", "")
+        projects, next_after = self.dal.getProjectsPage(limit=2)
+        assert len(projects) == 2
+        assert next_after is None
+
+
+class TestCompactRows(DALTestCase):
+    """Test class for the lean list query and compact project rows"""
+
+    def test_list_rows_carry_snippet_and_placeholder(self):
+        """Test that the list query cuts long descriptions and fills in the image"""
+        long_text = "x" * (self.dal.SNIPPET_LENGTH + 50)
+        exact_text = "y" * self.dal.SNIPPET_LENGTH
+        self.dal.saveProjectDB("Long", long_text, "")
+        self.dal.saveProjectDB("Exact", exact_text, "shot.png")
+
+        long_row, exact_row = self.dal.getAllProjects()
+        assert long_row["Description"] == "x" * self.dal.SNIPPET_LENGTH + "..."
+        assert long_row["Image"] == "placeholder.png"
+        assert exact_row["Description"] == exact_text
+        assert exact_row["Image"] == "shot.png"
+
+    def test_full_text_for_single_project_and_export(self):
+        """Test that getProjectById and full_text=True read the whole description"""
+        long_text = "z" * (self.dal.SNIPPET_LENGTH * 3)
+        project_id = self.dal.saveProjectDB("Long", long_text, "")
+
+        assert self.dal.getProjectById(project_id)["Description"] == long_text
+        assert [p["Description"] for p in self.dal.iterProjects(full_text=True)] == [long_text]
+
+    def test_rows_are_compact_and_keyed(self):
+        """Test that rows are sqlite3.Row, indexable by name and convertible to dict"""
+        project_id = self.dal.saveProjectDB("Title", "Description", "")
+        project = self.dal.getProjectById(project_id)
+        assert isinstance(project, sqlite3.Row)
+        assert dict(project) == {"id": project_id, "Title": "Title",
+                                 "Description": "Description", "Image": "placeholder.png"}
+
+
+class TestReadThroughCache(DALTestCase):
+    """Test class for the DAL read-through cache"""
+
+    def test_repeated_lookup_is_a_hit(self):
+        """Test that the second lookup of a project comes from the cache"""
+        self.dal.saveProjectDB("Cached", "Description", "")
+        project_id = self.dal.getAllProjects()[0]["id"]
+
+        self.dal.getProjectById(project_id)
+        before = self.dal.getCacheStats()
+        assert self.dal.getProjectById(project_id)["Title"] == "Cached"
+        after = self.dal.getCacheStats()
+        assert after["hits"] == before["hits"] + 1
+        assert after["misses"] == before["misses"]
+
+    def test_write_invalidates_cache(self):
+        """Test that every write path clears cached reads"""
+        self.dal.saveProjectDB("Before", "Description", "")
+        project_id = self.dal.getAllProjects()[0]["id"]
+        self.dal.getProjectById(project_id)
+
+        self.dal.updateProjectById(project_id, "After", "Description", "")
+        assert self.dal.getProjectById(project_id)["Title"] == "After"
+        assert self.dal.getAllProjects()[0]["Title"] == "After"
+
+        self.dal.deleteProjectById(project_id)
+        assert self.dal.getProjectById(project_id) is None
+        assert self.dal.getAllProjects() == []
+
+    def test_external_write_is_detected(self):
+        """Test that a commit from another connection (e.g. another worker) is seen"""
+        self.dal.saveProjectDB("Mine", "Description", "")
+        assert len(self.dal.getAllProjects()) == 1
+
+        conn = sqlite3.connect(self.test_db)
+        conn.execute("INSERT INTO projects (Title, Description) VALUES ('Theirs', 'Description')")
+        conn.commit()
+        conn.close()
+
+        assert [p["Title"] for p in self.dal.getAllProjects()] == ["Mine", "Theirs"]
+
+    def test_cached_page_is_served(self):
+        """Test that a bounded page is cached once fully read"""
+        self.dal.saveProjectDB("Paged", "Description", "")
+        self.dal.getProjectsPage(limit=10)
+        before = self.dal.getCacheStats()["hits"]
+        projects, next_after = self.dal.getProjectsPage(limit=10)
+        assert [p["Title"] for p in projects] == ["Paged"]
+        assert self.dal.getCacheStats()["hits"] == before + 1
+
+    def test_cache_is_bounded(self):
+        """Test that the LRU never grows past its limit"""
+        original = self.dal.CACHE_MAX_ENTRIES
+        self.dal.CACHE_MAX_ENTRIES = 3
+        try:
+            for project_id in range(10):
+                self.dal.getProjectById(project_id)
+            assert self.dal.getCacheStats()["entries"] == 3
+        finally:
+            self.dal.CACHE_MAX_ENTRIES = original
+
+    def test_cache_is_bounded_by_rows(self):
+        """Test that large pages can't fill memory: the cache holds at most CACHE_MAX_ROWS rows"""
+        self.dal.bulkSaveProjects((f"Project {n}", "Description", "") for n in range(80))
+        original = self.dal.CACHE_MAX_ROWS
+        self.dal.CACHE_MAX_ROWS = 60
+        try:
+            for after in range(20):
+                self.dal.getProjectsPage(after=after, limit=20)
+            stats = self.dal.getCacheStats()
+            assert stats["rows"] <= 60
+            assert stats["entries"] == 2
+
+            # A value bigger than the whole budget is never cached
+            self.dal.invalidateCache()
+            self.dal.getProjectsPage(limit=100)
+            assert self.dal.getCacheStats()["rows"] == 0
+        finally:
+            self.dal.CACHE_MAX_ROWS = original
+
+
+class TestSnapshotReads(DALTestCase):
+    """Test class for reads served from the in-memory snapshot"""
+
+    def teardown_method(self):
+        """Go back to reading from the file"""
+        self.dal.disableSnapshotReads()
+        super().teardown_method()
+
+    def _external_insert(self, title):
+        conn = sqlite3.connect(self.test_db)
+        conn.execute("INSERT INTO projects (Title, Description) VALUES (?, 'Description')", (title,))
+        conn.commit()
+        conn.close()
+
+    def test_own_writes_are_read_back_at_once(self):
+        """Test that a write in this process retires the snapshot for the next read"""
+        self.dal.enableSnapshotReads(max_staleness=60)
+        self.dal.saveProjectDB("First", "Description", "")
+        project_id = self.dal.getAllProjects()[0]["id"]
+
+        self.dal.updateProjectById(project_id, "Renamed", "Description", "")
+        assert self.dal.getProjectById(project_id)["Title"] == "Renamed"
+        assert [p["id"] for p in self.dal.searchProjects("Renamed")] == [project_id]
+
+    def test_one_copy_per_write(self):
+        """Test that reads share a copy until the next commit"""
+        self.dal.enableSnapshotReads(max_staleness=60)
+        self.dal.saveProjectDB("First", "Description", "")
+        taken = self.dal._snapshotStats["refreshes"]
+        for _ in range(3):
+            self.dal.getProjectsPage(limit=1)
+            self.dal.getProjectsVersion()
+        assert self.dal._snapshotStats["refreshes"] == taken + 1
+
+        self.dal.saveProjectDB("Second", "Description", "")
+        assert len(self.dal.getAllProjects()) == 2
+        assert self.dal._snapshotStats["refreshes"] == taken + 2
+
+    def test_external_writes_within_max_staleness(self):
+        """Test that another process's commit shows up once the staleness bound has passed"""
+        self.dal.enableSnapshotReads(max_staleness=60)
+        self.dal.saveProjectDB("Mine", "Description", "")
+        assert len(self.dal.getAllProjects()) == 1
+
+        self._external_insert("Theirs")
+        assert len(self.dal.getAllProjects()) == 1
+
+        self.dal.enableSnapshotReads(max_staleness=0)
+        assert [p["Title"] for p in self.dal.getAllProjects()] == ["Mine", "Theirs"]
+
+    def test_snapshot_is_read_only(self):
+        """Test that the snapshot connection refuses writes"""
+        self.dal.enableSnapshotReads()
+        with self.dal.readConnection() as conn:
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM projects")
+
+
+class TestFullTextSearch(DALTestCase):
+    """Test class for the FTS5 project search"""
+
+    def test_search_finds_and_highlights(self):
+        """Test that a saved project can be found with its terms marked"""
+        self.dal.saveProjectDB("Kayak Tracker", "Logs paddling trips", "")
+        results = self.dal.searchProjects("kayak")
+        assert len(results) == 1
+        assert results[0]["Title"] == self.dal.HIGHLIGHT_START + "Kayak" + self.dal.HIGHLIGHT_END + " Tracker"
+
+    def test_marker_characters_are_never_stored(self):
+        """Test that every write path strips the highlight markers, and the migration cleans old rows"""
+        start, end = self.dal.HIGHLIGHT_START, self.dal.HIGHLIGHT_END
+        new_id = self.dal.saveProjectDB(f"{start}Fake{end} mark", f"Desc {end}", "")
+        assert self.dal.getProjectById(new_id)["Title"] == "Fake mark"
+        self.dal.updateProjectById(new_id, f"Re{start}named", "D", "")
+        self.dal.bulkSaveProjects([(f"Bulk{end}", f"{start}D", "")])
+        assert [p["Title"] for p in self.dal.getAllProjects()] == ["Renamed", "Bulk"]
+
+        with self.dal.getConnection() as conn:
+            with conn:
+                conn.execute("INSERT INTO projects (Title, Description) VALUES (?, 'Old')", (f"{start}Legacy{end}",))
+                conn.execute("PRAGMA user_version = 7")
+                conn.execute("DELETE FROM schema_migrations WHERE version >= 8")
+        self.dal.createDatabase()
+        self.dal.invalidateCache()
+        assert self.dal.getAllProjects()[-1]["Title"] == "Legacy"
+        assert self.dal.searchProjects("legacy")[0]["Title"] == start + "Legacy" + end
+
+    def test_search_prefix_and_ranking(self):
+        """Test prefix matching, and that title matches rank above description matches"""
+        self.dal.saveProjectDB("Budget sheet", "Analytics for climbing gym", "")
+        self.dal.saveProjectDB("Climbing analytics", "Dashboard", "")
+        results = self.dal.searchProjects("climb")
+        assert [r["id"] for r in results][0] == 2
+        assert len(results) == 2
+
+    def test_triggers_follow_update_and_delete(self):
+        """Test that updates and deletes keep the index in sync"""
+        self.dal.saveProjectDB("Old title", "Description", "")
+        project_id = self.dal.getAllProjects()[0]["id"]
+        self.dal.updateProjectById(project_id, "New title", "Description", "")
+        assert self.dal.searchProjects("old") == []
+        assert len(self.dal.searchProjects("new")) == 1
+        self.dal.deleteProjectById(project_id)
+        assert self.dal.searchProjects("new") == []
+
+    def test_create_database_backfills_index(self):
+        """Test that rows written before the index existed are searchable"""
+        with self.dal.getConnection() as conn:
+            with conn:
+                conn.execute("DROP TABLE projects_fts")
+                conn.execute("DROP TRIGGER projects_fts_insert")
+                conn.execute("INSERT INTO projects (Title, Description) VALUES ('Legacy row', 'x')")
+                # Back to the schema version from before the search index
+                conn.execute("PRAGMA user_version = 3")
+                conn.execute("DELETE FROM schema_migrations WHERE version > 3")
+        self.dal.createDatabase()
+        assert len(self.dal.searchProjects("legacy")) == 1
+
+    def test_search_ignores_query_syntax(self):
+        """Test that FTS5 operators in user input don't raise"""
+        self.dal.saveProjectDB("Project", "Description", "")
+        assert self.dal.searchProjects('"unbalanced AND OR NEAR(') == []
+        assert self.dal.searchProjects("   ") == []
+
+
+class TestBulkImport(DALTestCase):
+    """Test class for bulk import and export"""
+
+    def test_bulk_save_in_chunks(self):
+        """Test that executemany chunks insert every row"""
+        rows = ((f"Project {n}", "Description", "") for n in range(7))
+        assert self.dal.bulkSaveProjects(rows, chunk_size=3) == 7
+        assert len(self.dal.getAllProjects()) == 7
+        assert len(self.dal.searchProjects("project")) == 7
+
+    def test_failed_import_keeps_committed_chunks_searchable(self):
+        """Test that chunks committed before a bad row are indexed as they are written"""
+        import sqlite3
+        rows = [("Partial", "Description", "")] * 3 + [(None, "Description", "")]
+        with pytest.raises(sqlite3.IntegrityError):
+            self.dal.bulkSaveProjects(rows, chunk_size=3)
+        assert len(self.dal.searchProjects("partial")) == 3
+
+    def test_import_csv_and_export_ndjson(self):
+        """Test a CSV import round-trips through the NDJSON export"""
+        import io
+        import json
+        import bulk_io
+        data = io.StringIO("Title,Description,ImageFileName\nOne,First,one.jpg\nTwo,\"Second, with comma\",\n")
+        assert bulk_io.import_projects(data, "csv") == 2
+        exported = [json.loads(line) for line in "".join(bulk_io.export_projects("ndjson")).splitlines()]
+        assert [p["Title"] for p in exported] == ["One", "Two"]
+        assert exported[1]["Description"] == "Second, with comma"
+        assert exported[1]["ImageFileName"] == "placeholder.png"
+
+    def test_import_rejects_invalid_record(self):
+        """Test that a record without a title stops the import"""
+        import io
+        import bulk_io
+        data = io.StringIO('{"Title": "Ok", "Description": "Fine"}\n{"Description": "No title"}\n')
+        with pytest.raises(ValueError, match="Line 2"):
+            bulk_io.import_projects(data, "ndjson")
+
+
+class TestAsyncDAL(DALTestCase):
+    """Test class for the awaitable DAL functions"""
+
+    def test_async_round_trip(self):
+        """Test that async writes and reads see the same data as the sync DAL"""
+        import asyncio
+
+        async def scenario():
+            await self.dal.saveProjectDBAsync("Async", "Saved from a coroutine", "")
+            page, _ = await self.dal.getProjectsPageAsync()
+            project = await self.dal.getProjectByIdAsync(page[0]["id"])
+            updated = await self.dal.updateProjectByIdAsync(page[0]["id"], "Renamed", "Changed", "")
+            found = await self.dal.searchProjectsAsync("renamed")
+            deleted = await self.dal.deleteProjectByIdAsync(page[0]["id"])
+            return project, updated, found, deleted
+
+        project, updated, found, deleted = asyncio.run(scenario())
+        assert project["Title"] == "Async"
+        assert updated and deleted
+        assert len(found) == 1
+        assert self.dal.getAllProjects() == []
+
+    def test_concurrent_async_writes_get_their_own_ids(self):
+        """Test that async writes gathered together each get back their own new id"""
+        import asyncio
+
+        async def scenario():
+            return await asyncio.gather(*(self.dal.saveProjectDBAsync(f"P{i}", "D", "") for i in range(20)))
+
+        ids = asyncio.run(scenario())
+        assert len(set(ids)) == 20
+        assert [self.dal.getProjectById(i)["Title"] for i in ids] == [f"P{i}" for i in range(20)]
+
+
+class TestGroupCommit(DALTestCase):
+    """Test class for the group-commit write queue"""
+
+    def test_concurrent_writes_share_commits(self):
+        """Test that writes queued at the same time are committed as one group"""
+        from concurrent.futures import ThreadPoolExecutor
+        groups = []
+        original = self.dal._commitGroup
+
+        def recording_commit(group):
+            groups.append(len(group))
+            original(group)
+
+        self.dal._commitGroup = recording_commit
+        try:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                ids = list(pool.map(lambda i: self.dal.saveProjectDB(f"P{i}", "D", ""), range(64)))
+        finally:
+            self.dal._commitGroup = original
+
+        assert sum(groups) == 64
+        assert len(groups) < 64
+        assert sorted(ids) == list(range(1, 65))
+
+    def test_each_write_gets_its_own_result(self):
+        """Test that a failing or no-op write in a group doesn't affect the others"""
+        import sqlite3
+        saved = self.dal._queueSaveProject("Good", "D", "")
+        missing = self.dal._queueUpdateProject(999, "T", "D", "")
+        failing = self.dal._queueSaveProject(None, "D", "")
+        deleted = self.dal._queueDeleteProject(1)
+
+        assert saved.result() == 1
+        assert missing.result() is False
+        with pytest.raises(sqlite3.IntegrityError):
+            failing.result()
+        assert deleted.result() is True
+        assert self.dal.getAllProjects() == []
+
+    def test_cancelled_write_keeps_the_writer_running(self):
+        """Test that a write cancelled while queued is skipped and later writes still commit"""
+        import threading
+        original = self.dal._commitGroup
+        busy, release = threading.Event(), threading.Event()
+
+        def held_commit(group):
+            busy.set()
+            release.wait(5)
+            original(group)
+
+        self.dal._commitGroup = held_commit
+        try:
+            first = self.dal._queueSaveProject("First", "D", "")
+            busy.wait(5)
+            cancelled = self.dal._queueSaveProject("Cancelled", "D", "")
+            assert cancelled.cancel()
+        finally:
+            self.dal._commitGroup = original
+            release.set()
+
+        assert first.result(5) == 1
+        assert self.dal.saveProjectDB("After", "D", "") == 2
+        assert [p["Title"] for p in self.dal.getAllProjects()] == ["First", "After"]
+
+    def test_writer_survives_a_failing_group(self):
+        """Test that an error outside the savepoints fails the group, not the writer thread"""
+        original = self.dal.invalidateCache
+
+        def broken():
+            raise RuntimeError("cache unavailable")
+
+        self.dal.invalidateCache = broken
+        try:
+            with pytest.raises(RuntimeError):
+                self.dal.saveProjectDB("First", "D", "")
+        finally:
+            self.dal.invalidateCache = original
+        assert self.dal.saveProjectDB("Second", "D", "") == 2
+
+    def test_write_is_visible_to_the_caller(self):
+        """Test that the cache is invalidated before a write returns"""
+        new_id = self.dal.saveProjectDB("First", "D", "")
+        assert self.dal.getProjectById(new_id)["Title"] == "First"
+        assert self.dal.updateProjectById(new_id, "Second", "D", "")
+        assert self.dal.getProjectById(new_id)["Title"] == "Second"
+
+
+class TestBenchmarkSuite(DALTestCase):
+    """Test class for the helpers behind benchmark.py"""
+
+    def test_synthetic_rows_are_reproducible(self):
+        """Test that the same seed always generates the same database"""
+        import benchmark
+        assert list(benchmark.synthetic_rows(20)) == list(benchmark.synthetic_rows(20))
+        assert len(list(benchmark.synthetic_rows(20))) == 20
+
+    def test_dal_benchmarks_report_percentiles(self):
+        """Test that every DAL benchmark reports latency percentiles"""
+        import benchmark
+        self.dal.bulkSaveProjects(benchmark.synthetic_rows(100))
+        results = benchmark.run_dal_benchmarks(100, iterations=3)
+        assert 'getAllProjects[cold]' in results
+        for summary in results.values():
+            assert summary['p50_ms'] <= summary['p95_ms'] <= summary['p99_ms']
+
+    def test_percentile_and_compare(self):
+        """Test nearest-rank percentiles and regression detection between two runs"""
+        import benchmark
+        samples = [i / 1000 for i in range(1, 101)]
+        assert benchmark.percentile(samples, 0.5) == 0.05
+        assert benchmark.percentile(samples, 0.99) == 0.099
+        old = {'sizes': {'10': {'dal': {'getAllProjects[cold]': benchmark.summarize([0.010])}}}}
+        new = {'sizes': {'10': {'dal': {'getAllProjects[cold]': benchmark.summarize([0.020])}}}}
+        rows, regressions = benchmark.compare(old, new)
+        assert regressions == ['10/dal/getAllProjects[cold]']
+        assert benchmark.compare(new, old)[1] == []
+
+
 def test_flask_app_import():
     """Test that Flask app can be imported"""
     try:
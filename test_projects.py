@@ -38,6 +38,101 @@ class TestFlaskApp:
         response = self.client.get('/projects')
         assert response.status_code == 200
     
+    def test_projects_route_is_streamed(self):
+        """Test that the projects page is streamed to the client"""
+        response = self.client.get('/projects')
+        assert response.is_streamed
+        assert b'Projects Database' in response.data
+
+    def test_projects_pagination(self):
+        """Test that ?limit= pages the projects table with a next link"""
+        for number in range(2):
+            self.client.post('/submit_project', data={
+                'title': f'Paged Project {number}',
+                'description': 'Paged description',
+            })
+        response = self.client.get('/projects?limit=1')
+        assert response.status_code == 200
+        assert response.data.count(b'<tbody>') == 1
+        assert b'Next page' in response.data
+
+    def test_projects_pagination_past_end(self):
+        """Test that a cursor past the last project shows the empty state"""
+        response = self.client.get('/projects?after=999999999')
+        assert response.status_code == 200
+        assert b'No projects found' in response.data
+        assert b'Next page' not in response.data
+
+    def test_search_route_highlights_and_escapes(self):
+        """Test that search results are highlighted and user text is escaped"""
+        self.client.post('/submit_project', data={
+            'title': 'Searchable <script>zebra</script>',
+            'description': 'Zebra crossing analysis',
+        })
+        response = self.client.get('/projects/search?q=zebra')
+        assert response.status_code == 200
+        assert b'<mark>zebra</mark>' in response.data
+        assert b'<script>' not in response.data
+
+    def test_search_markers_in_input_cannot_inject_marks(self):
+        """Test that marker characters posted in a form don't become <mark> tags"""
+        self.client.post('/submit_project', data={
+            'title': 'Okapi \x02injected\x03 notes',
+            'description': 'Okapi sightings',
+        })
+        response = self.client.get('/projects/search?q=okapi')
+        assert b'<mark>Okapi</mark>' in response.data
+        assert b'<mark>injected' not in response.data
+
+    def test_search_route_empty_query(self):
+        """Test that the search page renders without a query"""
+        response = self.client.get('/projects/search')
+        assert response.status_code == 200
+
+    def test_bulk_import_and_export_routes(self):
+        """Test importing an NDJSON body and streaming the CSV export"""
+        body = b'{"Title": "Bulk Route Project", "Description": "Imported"}\n'
+        response = self.client.post('/projects/import', data=body, content_type='application/x-ndjson')
+        assert response.status_code == 200
+        assert response.json == {'imported': 1}
+
+        response = self.client.get('/projects/export.csv')
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == 'text/csv'
+        assert b'Bulk Route Project' in response.data
+
+    def test_bulk_import_file_upload(self):
+        """Test importing a CSV sent as a multipart file part"""
+        import io
+        body = 'Title,Description\r\nUploaded CSV Project,"Two\r\nlines, and a café"\r\n'.encode('utf-8')
+        response = self.client.post('/projects/import', data={'file': (io.BytesIO(body), 'projects.csv')})
+        assert response.status_code == 200
+        assert response.json == {'imported': 1}
+        response = self.client.get('/projects/export.csv')
+        assert 'Two\r\nlines, and a café' in response.get_data(as_text=True)
+
+    def test_bulk_import_upload_reader_needs_only_read(self):
+        """Test decoding a file object without readable(), like SpooledTemporaryFile before 3.11"""
+        import bulk_io
+
+        class ReadOnly:
+            def __init__(self, data):
+                self.data = data
+
+            def read(self, size=-1):
+                size = len(self.data) if size < 0 else size
+                chunk, self.data = self.data[:size], self.data[size:]
+                return chunk
+
+        rows = list(bulk_io.read_rows(bulk_io.text_reader(ReadOnly('{"Title": "Ünïcode", "Description": "D"}\n'.encode())), 'ndjson'))
+        assert rows == [('Ünïcode', 'D', 'placeholder.png')]
+
+    def test_bulk_import_rejects_unknown_format(self):
+        """Test that an import with no recognizable format is a 400"""
+        response = self.client.post('/projects/import', data=b'x', content_type='text/plain')
+        assert response.status_code == 400
+
     def test_contact_route(self):
         """Test that contact page loads successfully"""
         response = self.client.get('/contact')
@@ -53,6 +148,41 @@ class TestFlaskApp:
         response = self.client.get('/thankyou')
         assert response.status_code == 200
     
+    def test_static_page_has_cache_headers(self):
+        """Test that pre-rendered pages carry a strong ETag and Cache-Control"""
+        response = self.client.get('/about')
+        assert response.status_code == 200
+        etag, weak = response.get_etag()
+        assert etag and not weak
+        assert response.last_modified is not None
+        assert response.cache_control.public
+
+    def test_static_page_conditional_get(self):
+        """Test that a matching If-None-Match gets a 304 with no body"""
+        etag = self.client.get('/resume').get_etag()[0]
+        response = self.client.get('/resume', headers={'If-None-Match': f'"{etag}"'})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    def test_static_page_rerendered_when_template_changes(self):
+        """Test that touching a template invalidates its cached page"""
+        import os
+        from app import page_cache
+        page_cache.check_interval = 0
+        try:
+            self.client.get('/about')
+            entry = page_cache._entries['about.html']
+            template = os.path.join(self.app.root_path, 'templates', 'base.html')
+            stat = os.stat(template)
+            os.utime(template, (stat.st_atime, stat.st_mtime + 10))
+            try:
+                self.client.get('/about')
+                assert page_cache._entries['about.html'] is not entry
+            finally:
+                os.utime(template, (stat.st_atime, stat.st_mtime))
+        finally:
+            page_cache.check_interval = 1.0
+
     def test_contact_form_submission(self):
         """Test contact form submission"""
         response = self.client.post('/submit_contact', data={
@@ -65,6 +195,54 @@ class TestFlaskApp:
         })
         assert response.status_code == 302  # Redirect after successful submission
     
+    def test_contact_submission_is_saved_hashed(self):
+        """Test that a contact submission is saved in the background with a hashed password"""
+        from app import contact_queue
+        from contacts import verify_password
+        from DAL import getAllContacts, getContactPasswordHash
+        response = self.client.post('/submit_contact', data={
+            'firstName': 'Jane',
+            'lastName': 'Queued',
+            'email': 'jane.queued@example.com',
+            'password': 'correct horse',
+            'confirmPassword': 'correct horse',
+            'message': 'Saved later'
+        })
+        assert response.status_code == 302
+        assert contact_queue.join(timeout=30)
+
+        saved = next(c for c in getAllContacts() if c['Email'] == 'jane.queued@example.com')
+        assert 'PasswordHash' not in saved
+        stored = getContactPasswordHash(saved['id'])
+        assert stored.startswith('scrypt$')
+        assert 'correct horse' not in stored
+        assert verify_password('correct horse', stored)
+        assert not verify_password('wrong horse', stored)
+
+    def test_contact_queue_full_returns_503(self):
+        """Test that submissions are refused with Retry-After when the queue is full"""
+        import app as app_module
+        from contacts import ContactQueue, ContactQueueFull
+
+        class FullQueue(ContactQueue):
+            def submit(self, *args):
+                raise ContactQueueFull()
+
+        original = app_module.contact_queue
+        app_module.contact_queue = FullQueue()
+        try:
+            response = self.client.post('/submit_contact', data={
+                'firstName': 'John',
+                'lastName': 'Doe',
+                'email': 'john.doe@example.com',
+                'password': 'password123',
+                'confirmPassword': 'password123',
+            })
+        finally:
+            app_module.contact_queue = original
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+
     def test_contact_form_validation_missing_fields(self):
         """Test contact form validation for missing fields"""
         response = self.client.post('/submit_contact', data={
@@ -121,6 +299,47 @@ class TestFlaskApp:
         response = self.client.get('/static/css/styles.css')
         assert response.status_code == 200
     
+    def test_static_css_precompressed(self):
+        """Test that static assets are served from a precompressed sibling"""
+        import gzip
+        plain = self.client.get('/static/css/styles.css')
+        response = self.client.get('/static/css/styles.css', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.mimetype == 'text/css'
+        assert 'Accept-Encoding' in response.vary
+        assert gzip.decompress(response.data) == plain.data
+
+    def test_range_request_is_not_compressed(self):
+        """Test that byte ranges always apply to the uncompressed file"""
+        response = self.client.get('/resume.pdf', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-9'})
+        assert response.status_code == 206
+        assert 'Content-Encoding' not in response.headers
+
+    def test_streamed_page_compressed_on_the_fly(self):
+        """Test that /projects is gzipped as it streams"""
+        import gzip
+        response = self.client.get('/projects', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'Projects Database' in gzip.decompress(response.data)
+
+    def test_cached_page_compressed_keeps_conditional_get(self):
+        """Test that a gzipped page gets a weak ETag that still revalidates"""
+        response = self.client.get('/about', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        etag, weak = response.get_etag()
+        assert weak
+        response = self.client.get('/about', headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': f'W/"{etag}"',
+        })
+        assert response.status_code == 304
+
+    def test_small_response_not_compressed(self):
+        """Test that tiny bodies are sent as they are"""
+        response = self.client.post('/submit_project', data={'title': 'x'}, headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+
     def test_image_serving(self):
         """Test that images are served correctly"""
         # This test assumes there are images in the static/images directory
@@ -134,11 +353,571 @@ class TestFlaskApp:
         # Should return 200 if PDF exists, 404 if not
         assert response.status_code in [200, 404]
     
+    def test_resume_pdf_range_request(self):
+        """Test that a single byte range gets a 206 with just those bytes"""
+        full = self.client.get('/resume.pdf')
+        response = self.client.get('/resume.pdf', headers={'Range': 'bytes=100-199'})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == f'bytes 100-199/{len(full.data)}'
+        assert response.data == full.data[100:200]
+        assert response.headers['Accept-Ranges'] == 'bytes'
+
+    def test_resume_pdf_if_range_mismatch(self):
+        """Test that a stale If-Range gets the whole file instead of a range"""
+        response = self.client.get('/resume.pdf', headers={
+            'Range': 'bytes=0-9',
+            'If-Range': '"not-the-current-etag"',
+        })
+        assert response.status_code == 200
+        assert len(response.data) > 10
+
+    def test_resume_pdf_unsatisfiable_range(self):
+        """Test that a range past the end of the file gets a 416"""
+        response = self.client.get('/resume.pdf', headers={'Range': 'bytes=99999999-'})
+        assert response.status_code == 416
+        assert response.headers['Content-Range'].startswith('bytes */')
+
+    def test_image_conditional_get(self):
+        """Test that images revalidate with ETag and If-Modified-Since"""
+        first = self.client.get('/images/kyn.jpg')
+        assert first.status_code == 200
+        etag = first.get_etag()[0]
+        response = self.client.get('/images/kyn.jpg', headers={'If-None-Match': f'"{etag}"'})
+        assert response.status_code == 304
+        response = self.client.get('/images/kyn.jpg', headers={
+            'If-Modified-Since': first.headers['Last-Modified'],
+        })
+        assert response.status_code == 304
+
+    def test_image_path_traversal_rejected(self):
+        """Test that /images cannot escape the images directory"""
+        response = self.client.get('/images/../../app.py')
+        assert response.status_code == 404
+
+    def test_fingerprinted_files_are_immutable(self):
+        """Test that only content-hashed file names get immutable caching"""
+        from file_server import FINGERPRINT_PATTERN
+        assert FINGERPRINT_PATTERN.search('headshot-320w.3f2a9c1b4d5e.jpg')
+        assert FINGERPRINT_PATTERN.search('9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.png')
+        assert not FINGERPRINT_PATTERN.search('headshot.jpg')
+        assert not FINGERPRINT_PATTERN.search('deloitte logo.jpg')
+
+    def test_date_named_files_are_not_immutable(self):
+        """Test that all-digit date stamps aren't mistaken for content hashes"""
+        from file_server import FINGERPRINT_PATTERN
+        for name in ('IMG_20231105.jpg', 'report-20240101.pdf', 'scan.20240101.png',
+                     'photo-320w.202401011200.jpg', '2024010112000000.png', 'app.3f2a9c1b.css'):
+            assert not FINGERPRINT_PATTERN.search(name), name
+
+    def test_image_width_variant(self):
+        """Test that ?w= serves a smaller generated variant of an image"""
+        pytest.importorskip('PIL')
+        original = self.client.get('/images/headshot.jpg')
+        response = self.client.get('/images/headshot.jpg?w=150')
+        assert response.status_code == 200
+        assert response.mimetype == 'image/jpeg'
+        assert len(response.data) < len(original.data)
+        assert 'Accept' in response.vary
+
+        response = self.client.get('/images/headshot.jpg?w=150', headers={'Accept': 'image/webp,*/*;q=0.8'})
+        assert response.mimetype == 'image/webp'
+
+    def test_image_variants_stay_inside_their_directories(self, tmp_path):
+        """Test that absolute and ../ filenames get no variants and write nothing outside"""
+        Image = pytest.importorskip('PIL.Image')
+        from images import ImageVariants
+        source_dir = tmp_path / 'images'
+        source_dir.mkdir()
+        Image.new('RGB', (400, 300)).save(tmp_path / 'victim.jpg')
+        variants = ImageVariants(str(source_dir), widths=(160,))
+
+        assert variants.variants(str(tmp_path / 'victim.jpg')) == []
+        assert variants.variants('../victim.jpg') == []
+        assert variants.variants('uploads/../../victim.jpg') == []
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['images', 'victim.jpg']
+        assert not (source_dir / '_variants').exists()
+
+        Image.new('RGB', (400, 300)).save(source_dir / 'team photo.jpg')
+        names = [v['name'] for v in variants.variants('team photo.jpg')]
+        assert names and all(name.startswith('team-photo-160w.') for name in names)
+
+    def test_image_variant_lookups_stay_cheap(self, tmp_path, monkeypatch):
+        """Test that pages never generate variants, misses aren't remembered and the manifest is parsed once"""
+        Image = pytest.importorskip('PIL.Image')
+        import images
+        source_dir = tmp_path / 'images'
+        source_dir.mkdir()
+        Image.new('RGB', (400, 300)).save(source_dir / 'photo.jpg')
+        variants = images.ImageVariants(str(source_dir), widths=(160,))
+        with self.app.test_request_context():
+            assert variants.srcset('photo.jpg') == ''
+        assert not (source_dir / '_variants').exists()
+
+        built = variants.variants('photo.jpg')
+        assert built and variants.variants('photo.jpg', generate=False) == built
+
+        for n in range(50):
+            assert variants.variants(f'missing-{n}.jpg') == []
+        assert list(variants._checked) == ['photo.jpg']
+        monkeypatch.setattr(images, 'MAX_CHECKED', 1)
+        Image.new('RGB', (400, 300)).save(source_dir / 'other.jpg')
+        variants.variants('other.jpg')
+        assert list(variants._checked) == ['other.jpg']
+
+        # Lookups after a revalidation don't parse an unchanged manifest again
+        loads = []
+        monkeypatch.setattr(images.json, 'load', lambda f: loads.append(f) or {})
+        variants._checked.clear()
+        variants._manifest_checked = 0.0
+        assert variants.variants('photo.jpg', generate=False) == built
+        assert loads == []
+
+    def test_image_srcset_in_templates(self):
+        """Test that the projects table offers responsive variants, and skips the placeholder"""
+        pytest.importorskip('PIL')
+        from app import image_variants
+        image_variants.variants('headshot.jpg')
+        with self.app.test_request_context():
+            srcset = image_variants.srcset('headshot.jpg', 'webp')
+            assert '160w' in srcset and '/images/_variants/' in srcset
+            assert image_variants.srcset('placeholder.png') == ''
+        variant = image_variants.variants('headshot.jpg')[0]['name']
+        response = self.client.get('/images/_variants/' + variant)
+        assert response.status_code == 200
+        assert response.cache_control.immutable
+
     def test_404_error_handler(self):
         """Test 404 error handling"""
         response = self.client.get('/nonexistent-page')
         assert response.status_code == 404
     
+    def test_preload_compiles_templates(self):
+        """Test that preload() leaves every template compiled in the Jinja cache"""
+        from app import preload
+        preload()
+        cache = self.app.jinja_env.cache
+        for name in self.app.jinja_env.list_templates():
+            assert any(key[1] == name for key in cache.keys())
+
+    def test_healthz(self):
+        """Test that the health check answers without rendering anything"""
+        response = self.client.get('/healthz')
+        assert response.status_code == 200
+        assert response.data == b'ok'
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics reports per-endpoint requests and DAL query timings"""
+        self.client.get('/projects').data
+        self.client.get('/nonexistent-page')
+        body = self.client.get('/metrics').data.decode()
+        assert 'http_requests_total{endpoint="projects",method="GET",status="200"}' in body
+        assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"}' in body
+        assert 'http_request_duration_seconds_bucket{endpoint="projects",method="GET",le="+Inf"}' in body
+        assert 'dal_query_duration_seconds_count{function="iterProjects"}' in body
+        assert 'dal_query_rows_total{function="iterProjects"}' in body
+        assert 'dal_cache_hits_total' in body
+
+    def test_metrics_histogram_is_cumulative(self):
+        """Test the exposition format of a histogram"""
+        from metrics import Registry
+        registry = Registry(buckets=(0.1, 1.0))
+        registry.observe('latency_seconds', (('route', 'a'),), 0.05)
+        registry.observe('latency_seconds', (('route', 'a'),), 0.5)
+        registry.observe('latency_seconds', (('route', 'a'),), 5)
+        body = registry.render()
+        assert 'latency_seconds_bucket{route="a",le="0.1"} 1' in body
+        assert 'latency_seconds_bucket{route="a",le="1.0"} 2' in body
+        assert 'latency_seconds_bucket{route="a",le="+Inf"} 3' in body
+        assert 'latency_seconds_count{route="a"} 3' in body
+
+    def test_templates_use_bytecode_cache(self, tmp_path):
+        """Test that compiled templates are written to and loaded from the bytecode cache"""
+        from app import template_bytecode_cache
+        from jinja2 import Environment, FileSystemLoader
+        cache_dir = str(tmp_path / 'jinja')
+        env = Environment(loader=FileSystemLoader(self.app.template_folder),
+                          bytecode_cache=template_bytecode_cache(cache_dir))
+        env.get_template('base.html')
+        assert len(list((tmp_path / 'jinja').iterdir())) == 1
+
+        fresh = Environment(loader=FileSystemLoader(self.app.template_folder),
+                            bytecode_cache=template_bytecode_cache(cache_dir))
+        fresh.compile = None  # a cache hit never compiles
+        fresh.get_template('base.html')
+
+    def test_preload_reports_startup_timings(self):
+        """Test that preload compiles every template and records each startup phase"""
+        from app import preload, startup_timings
+        preload()
+        for phase in ('import', 'db_init', 'templates', 'files'):
+            assert startup_timings[phase] >= 0
+        body = self.client.get('/metrics').data.decode()
+        assert 'startup_duration_seconds{phase="templates"}' in body
+
+    def test_api_projects_pages(self):
+        """Test that the JSON API lists projects page by page"""
+        from DAL import saveProjectDB
+        for i in range(3):
+            saveProjectDB(f'API project {i}', 'Listed by the API', '')
+        first = self.client.get('/api/projects?limit=2')
+        assert first.status_code == 200
+        assert first.is_streamed
+        data = first.get_json()
+        assert len(data['projects']) == 2
+        assert data['next_after'] == data['projects'][-1]['id']
+        rest = self.client.get(f"/api/projects?limit=2&after={data['next_after']}").get_json()
+        assert rest['projects'][0]['id'] > data['next_after']
+
+    def test_api_projects_have_full_descriptions(self):
+        """Test that the list API returns the same project as the single-project API"""
+        from DAL import saveProjectDB
+        project_id = saveProjectDB('API long', 'Word ' * 100, '')
+        listed = self.client.get(f'/api/projects?after={project_id - 1}&limit=1').get_json()['projects']
+        assert listed == [self.client.get(f'/api/projects/{project_id}').get_json()]
+        assert not listed[0]['Description'].endswith('...')
+
+    def test_api_project_by_id(self):
+        """Test fetching one project and a missing one"""
+        from DAL import saveProjectDB
+        project_id = saveProjectDB('API single', 'One project', '')
+        data = self.client.get(f'/api/projects/{project_id}').get_json()
+        assert data == {'id': project_id, 'Title': 'API single', 'Description': 'One project',
+                        'Image': 'placeholder.png'}
+        response = self.client.get('/api/projects/999999999')
+        assert response.status_code == 404
+        assert response.get_json()['error']
+
+    def test_api_etag_and_304(self):
+        """Test that an unchanged table answers 304 and any write changes the ETag"""
+        from DAL import saveProjectDB
+        etag = self.client.get('/api/projects').headers['ETag']
+        response = self.client.get('/api/projects', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        # Also after the gzip hook has weakened the ETag
+        response = self.client.get('/api/projects', headers={'If-None-Match': 'W/' + etag})
+        assert response.status_code == 304
+
+        saveProjectDB('Changes the ETag', 'Description', '')
+        response = self.client.get('/api/projects', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_files_use_x_accel_redirect_behind_nginx(self):
+        """Test that file routes hand the file to nginx when it asks for X-Accel-Redirect"""
+        nginx = {'X-Sendfile-Type': 'X-Accel-Redirect'}
+        response = self.client.get('/static/css/styles.css', headers=nginx)
+        assert response.status_code == 200
+        assert response.headers['X-Accel-Redirect'] == '/_accel/static/css/styles.css'
+        assert response.data == b''
+        assert response.headers['Cache-Control']
+        assert 'Content-Encoding' not in response.headers
+
+        response = self.client.get('/resume.pdf', headers=nginx)
+        assert response.headers['X-Accel-Redirect'] == '/_accel/resume/resume.pdf'
+
+        # The app still answers conditional requests itself
+        etag = self.client.get('/static/css/styles.css').headers['ETag']
+        response = self.client.get('/static/css/styles.css', headers=dict(nginx, **{'If-None-Match': etag}))
+        assert response.status_code == 304
+        assert 'X-Accel-Redirect' not in response.headers
+
+        # Without nginx in front (or with the toggle off) the app sends the bytes
+        assert 'X-Accel-Redirect' not in self.client.get('/static/css/styles.css').headers
+        self.app.config['USE_X_ACCEL_REDIRECT'] = False
+        try:
+            response = self.client.get('/static/css/styles.css', headers=nginx)
+        finally:
+            self.app.config['USE_X_ACCEL_REDIRECT'] = True
+        assert 'X-Accel-Redirect' not in response.headers
+        assert response.data
+
+    def test_gzip_stream_flushes_the_head_right_away(self):
+        """Test that each chunk of a streamed page head can be decoded before the next is produced"""
+        import zlib
+        from compression import _gzip_stream
+        decoder = zlib.decompressobj(31)
+        stream = _gzip_stream(iter(['<html><head>', '<link rel="stylesheet">', '</head>']), 6)
+        assert decoder.decompress(next(stream)) == b'<html><head>'
+        assert decoder.decompress(next(stream)) == b'<link rel="stylesheet">'
+
+    def test_precompress_falls_back_to_the_identity_file(self, tmp_path, monkeypatch):
+        """Test that concurrent precompression is safe and a failed one serves the plain file"""
+        import os
+        import threading
+        import compression
+        from file_server import FileIndex, send_indexed_file
+        css = tmp_path / 'site.css'
+        css.write_text('body { color: purple; }\n' * 100)
+        threads = [threading.Thread(target=compression.precompress, args=(str(css), ('gzip',)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['site.css', 'site.css.gz']
+
+        # The file changed and its sibling can't be rewritten: send it uncompressed
+        css.write_text('body { color: indigo; }\n' * 100)
+        os.utime(css, ns=(css.stat().st_mtime_ns + 10**9,) * 2)
+        def fail(*args):
+            raise PermissionError('read-only')
+        monkeypatch.setattr(compression.os, 'replace', fail)
+        index = FileIndex(str(tmp_path), encodings=('gzip',))
+        with self.app.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+            response = send_indexed_file(index, 'site.css')
+            response.direct_passthrough = False
+            assert 'Content-Encoding' not in response.headers
+            assert b'indigo' in response.get_data()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['site.css', 'site.css.gz']
+
+    def test_scan_never_compresses_siblings(self, tmp_path):
+        """Test that indexing a directory twice doesn't compress the .gz/.br files again"""
+        from file_server import FileIndex
+        (tmp_path / 'site.css').write_text('body { color: purple; }\n' * 100)
+        FileIndex(str(tmp_path), encodings=('gzip',)).scan()
+        FileIndex(str(tmp_path), encodings=('gzip',)).scan()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['site.css', 'site.css.gz']
+
+    def test_project_pages_carry_surrogate_keys(self):
+        """Test that project pages are tagged for the nginx micro-cache"""
+        for url in ('/projects', '/api/projects', '/projects/search?q=x'):
+            response = self.client.get(url)
+            assert response.headers['Surrogate-Key'] == 'projects'
+            assert response.headers['X-Accel-Expires'] == '5'
+        assert 'Surrogate-Key' not in self.client.get('/about').headers
+
+    def test_project_writes_purge_the_micro_cache(self):
+        """Test that a successful project write refreshes the cached project pages"""
+        from app import edge_cache
+        purged = []
+        original = edge_cache.purge
+        edge_cache.purge = lambda *keys: purged.append((keys, original(*keys)))
+        try:
+            self.client.get('/projects?limit=7')
+            self.client.post('/submit_project', data={
+                'title': 'Purges the cache', 'description': 'Description', 'image_filename': ''})
+        finally:
+            edge_cache.purge = original
+        assert len(purged) == 1
+        keys, urls = purged[0]
+        assert keys == ('projects',)
+        assert '/projects?limit=7' in urls
+
+    def test_image_upload_is_content_addressed(self):
+        """Test that uploaded images are stored once under their hash and served immutable"""
+        import hashlib
+        import io
+        import os
+        from app import image_uploads
+        from DAL import getAllProjects
+        image = b'\x89PNG\r\n\x1a\n' + os.urandom(256 * 1024)
+        name = hashlib.sha256(image).hexdigest() + '.png'
+        stored = os.path.join(image_uploads.directory, name)
+        try:
+            for title in ('Uploaded image', 'Same image again'):
+                response = self.client.post('/submit_project', data={
+                    'title': title, 'description': 'Description', 'image_filename': '',
+                    'image_file': (io.BytesIO(image), 'screenshot.png')})
+                assert response.status_code == 302
+            images = {p['Title']: p['Image'] for p in getAllProjects()}
+            assert images['Uploaded image'] == images['Same image again'] == 'uploads/' + name
+            assert os.listdir(image_uploads.directory).count(name) == 1
+            assert not [f for f in os.listdir(image_uploads.directory) if f.endswith('.part')]
+
+            response = self.client.get('/images/uploads/' + name)
+            assert response.status_code == 200
+            assert response.data == image
+            assert response.cache_control.immutable
+        finally:
+            if os.path.exists(stored):
+                os.remove(stored)
+
+    def test_failed_project_writes_leave_no_upload_behind(self):
+        """Test that invalid forms and failed writes don't keep the uploaded image, unless it was already stored"""
+        import hashlib
+        import io
+        import os
+        from app import image_uploads
+        from DAL import saveProjectDB
+        image = b'\x89PNG\r\n\x1a\n' + os.urandom(1024)
+        stored = os.path.join(image_uploads.directory, hashlib.sha256(image).hexdigest() + '.png')
+        try:
+            self.client.post('/submit_project', data={
+                'title': '', 'description': 'Description', 'image_file': (io.BytesIO(image), 'a.png')})
+            assert not os.path.exists(stored)
+
+            self.client.post('/update_project/999999999', data={
+                'title': 'Missing', 'description': 'Description', 'image_file': (io.BytesIO(image), 'a.png')})
+            assert not os.path.exists(stored)
+
+            # Stored by an earlier project: a failed write must not delete it
+            project_id = saveProjectDB('Kept', 'Description', '')
+            self.client.post(f'/update_project/{project_id}', data={
+                'title': 'Kept', 'description': 'Description', 'image_file': (io.BytesIO(image), 'a.png')})
+            assert os.path.exists(stored)
+            self.client.post('/update_project/999999999', data={
+                'title': 'Missing', 'description': 'Description', 'image_file': (io.BytesIO(image), 'a.png')})
+            assert os.path.exists(stored)
+        finally:
+            if os.path.exists(stored):
+                os.remove(stored)
+
+    def test_image_upload_limits(self):
+        """Test that oversized and non-image uploads are refused and leave nothing behind"""
+        import io
+        import os
+        from app import image_uploads
+        before = sorted(os.listdir(image_uploads.directory)) if os.path.isdir(image_uploads.directory) else []
+        original = image_uploads.max_size
+        image_uploads.max_size = 64 * 1024
+        try:
+            response = self.client.post('/submit_project', data={
+                'title': 'Too big', 'description': 'Description',
+                'image_file': (io.BytesIO(b'\xff\xd8\xff' + b'0' * 128 * 1024), 'big.jpg')})
+            assert response.status_code == 302
+            response = self.client.post('/submit_project', data={
+                'title': 'Not an image', 'description': 'Description',
+                'image_file': (io.BytesIO(b'#!/bin/sh\n'), 'script.png')})
+            assert response.status_code == 302
+        finally:
+            image_uploads.max_size = original
+        with self.client.session_transaction() as session:
+            messages = [message for _, message in session.get('_flashes', [])]
+        assert any('at most' in message for message in messages)
+        assert any('PNG, JPEG' in message for message in messages)
+        assert sorted(os.listdir(image_uploads.directory)) == before
+
+    def test_upload_views_only_store_the_image_field(self):
+        """Test that other file fields aren't stored and oversized bodies are refused up front"""
+        import io
+        import os
+        from app import image_uploads
+        from uploads import MAX_FORM_OVERHEAD
+        before = sorted(os.listdir(image_uploads.directory)) if os.path.isdir(image_uploads.directory) else []
+        parts = []
+        original_open = image_uploads._open_part
+        image_uploads._open_part = lambda: parts.append(1) or original_open()
+        try:
+            response = self.client.post('/submit_project', data={
+                'title': 'Extra file field', 'description': 'Description', 'image_filename': '',
+                'attachment': (io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'0' * 1024), 'other.png')})
+            assert response.status_code == 302
+            assert parts == []
+
+            original_size = image_uploads.max_size
+            image_uploads.max_size = 1024
+            try:
+                response = self.client.post('/submit_project', data={
+                    'title': 'Huge form', 'description': 'x' * (MAX_FORM_OVERHEAD + 2048)})
+            finally:
+                image_uploads.max_size = original_size
+            assert response.status_code == 302
+            assert parts == []
+        finally:
+            image_uploads._open_part = original_open
+        with self.client.session_transaction() as session:
+            messages = [message for _, message in session.get('_flashes', [])]
+        assert any('capacity limit' in message for message in messages)
+        after = sorted(os.listdir(image_uploads.directory)) if os.path.isdir(image_uploads.directory) else []
+        assert after == before
+
+    def test_write_routes_are_rate_limited_per_client(self):
+        """Test that a client past its burst gets 429 with Retry-After, and others don't"""
+        from app import rate_limiter
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        self.app.config['RATE_LIMITS_ENABLED'] = True
+        rate_limiter.clear()
+        original_wsgi = self.app.wsgi_app
+        self.app.wsgi_app = ProxyFix(original_wsgi, x_for=1)
+        try:
+            client = {'X-Forwarded-For': '203.0.113.7'}
+            statuses = [self.client.post('/delete_project/999999', headers=client).status_code
+                        for _ in range(10)]
+            assert statuses == [302] * 10
+            response = self.client.post('/delete_project/999999', headers=client)
+            assert response.status_code == 429
+            assert int(response.headers['Retry-After']) >= 1
+
+            # Another client behind the same proxy has its own bucket
+            other = {'X-Forwarded-For': '203.0.113.8'}
+            assert self.client.post('/delete_project/999999', headers=other).status_code == 302
+            # Imports are limited too, and far more tightly
+            statuses = [self.client.post('/projects/import', headers=client).status_code for _ in range(3)]
+            assert statuses == [400, 400, 429]
+            # Reads are never limited
+            assert self.client.get('/projects', headers=client).status_code == 200
+        finally:
+            self.app.wsgi_app = original_wsgi
+            self.app.config['RATE_LIMITS_ENABLED'] = False
+            rate_limiter.clear()
+
+    def test_backed_up_writes_get_a_fast_503(self):
+        """Test that write routes shed load while the DAL write queue is full"""
+        original = self.app.config['MAX_PENDING_WRITES']
+        self.app.config['RATE_LIMITS_ENABLED'] = True
+        self.app.config['MAX_PENDING_WRITES'] = 0
+        try:
+            response = self.client.post('/submit_project', data={'title': 'Shed', 'description': 'Description'})
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+            response = self.client.post('/projects/import?format=ndjson', data=b'{"Title": "Shed"}\n')
+            assert response.status_code == 503
+        finally:
+            self.app.config['MAX_PENDING_WRITES'] = original
+            self.app.config['RATE_LIMITS_ENABLED'] = False
+
+    def test_token_buckets_refill_and_expire(self):
+        """Test that buckets refill at the route's rate and idle clients are forgotten"""
+        from rate_limit import RouteLimit
+        route = RouteLimit(per_minute=60, burst=2)
+        assert route.take('a', 0.0) == 0
+        assert route.take('a', 0.0) == 0
+        assert route.take('a', 0.0) == pytest.approx(1.0)
+        assert route.take('a', 0.5) == pytest.approx(0.5)
+        assert route.take('a', 1.5) == 0
+
+        route.take('b', 2.0)
+        route.take('c', 10.0)
+        assert list(route.buckets) == ['c']
+
+    def test_profile_header_writes_pstats_and_collapsed_stacks(self, tmp_path):
+        """Test that an authorized X-Profile request is profiled, streamed body included"""
+        import pstats
+        self.app.config.update(PROFILE_TOKEN='secret', PROFILE_DIR=str(tmp_path))
+        try:
+            response = self.client.get('/projects', headers={'X-Profile': 'secret'})
+            assert response.data
+            response.close()
+            endpoint, stamp = response.headers['X-Profile-Id'].split('/')
+            assert endpoint == 'projects'
+
+            stats = pstats.Stats(str(tmp_path / endpoint / f'{stamp}.pstats'))
+            assert any(name == 'projects' for _, _, name in stats.stats)
+            lines = (tmp_path / endpoint / f'{stamp}.collapsed').read_text().splitlines()
+            assert lines
+            assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+            # The template is rendered while the response streams
+            assert any('projects.html' in line for line in lines)
+
+            # A wrong token is ignored
+            response = self.client.get('/projects', headers={'X-Profile': 'guess'})
+            assert 'X-Profile-Id' not in response.headers
+        finally:
+            self.app.config.update(PROFILE_TOKEN=None)
+
+    def test_profile_sampling(self, tmp_path):
+        """Test that PROFILE_SAMPLE_RATE profiles requests without any header"""
+        self.app.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=str(tmp_path))
+        try:
+            response = self.client.get('/about')
+            response.close()
+        finally:
+            self.app.config.update(PROFILE_SAMPLE_RATE=0.0)
+        assert response.headers['X-Profile-Id'].startswith('about/')
+        assert sorted(p.suffix for p in (tmp_path / 'about').iterdir()) == ['.collapsed', '.pstats']
+        assert 'X-Profile-Id' not in self.client.get('/about').headers
+
     def test_app_configuration(self):
         """Test Flask app configuration"""
         assert self.app.secret_key is not None
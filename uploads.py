@@ -0,0 +1,234 @@
+"""
+Content-addressed image uploads, streamed to disk while they are hashed
+
+Views tagged with ``@image_uploads.accepts`` get the file part of their
+image field (``image_file``) written straight into ``static/images/uploads``
+in chunks as the body is parsed, instead of into memory or a spooled
+temporary file. The part is hashed (SHA-256) as it is written and capped at
+``max_size`` bytes; a part over the cap fails the request with 413 as soon
+as the cap is crossed. File parts under any other field name are read and
+thrown away, and the whole body may be at most ``max_size`` plus
+``MAX_FORM_OVERHEAD`` bytes.
+
+``save`` then renames the part to ``<sha256>.<ext>``. A file that was
+uploaded before already exists under that name, so the duplicate is simply
+dropped. Because the name is the content, ``send_indexed_file`` serves it
+with immutable cache headers. Parts a view doesn't save are deleted when
+the request ends, and a view whose write fails after saving calls
+``discard_saved`` to delete the files the request added.
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+from flask import g
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser, MultiPartParser
+
+UPLOADS_DIRNAME = 'uploads'
+
+# Largest image accepted, in bytes (MAX_IMAGE_UPLOAD_SIZE in the app config)
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+# Room in an upload request's body for everything besides the image: the
+# other form fields and the multipart headers
+MAX_FORM_OVERHEAD = 1024 * 1024
+
+# The form field whose file is stored
+UPLOAD_FIELD = 'image_file'
+
+# Leading bytes that identify each accepted image type, and the extension
+# it is stored with. The client's filename and Content-Type are not trusted
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+SIGNATURE_BYTES = 12
+
+
+class UploadRejected(ValueError):
+    """Raised by ``ImageUploads.save`` for a file that isn't an accepted image."""
+
+
+class HashingFile:
+    """A temporary file in the uploads directory that hashes everything written to it."""
+
+    def __init__(self, directory, max_size):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.part')
+        self.max_size = max_size
+        self.size = 0
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge(f"Images can be at most {self.max_size // (1024 * 1024)} MB.")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def discard(self):
+        """Close the file and delete it unless it has been saved."""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __getattr__(self, name):
+        # seek/read/close etc. for FileStorage
+        return getattr(self._file, name)
+
+
+class DiscardedPart(io.BytesIO):
+    """Stands in for a file part nobody asked for; whatever is written is dropped."""
+
+    def write(self, data):
+        return len(data)
+
+
+class UploadParser(MultiPartParser):
+    """Stream only ``field``'s file part through the stream factory."""
+
+    def __init__(self, field, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.field = field
+
+    def start_file_streaming(self, event, total_content_length):
+        if event.name != self.field:
+            return DiscardedPart()
+        return super().start_file_streaming(event, total_content_length)
+
+
+class UploadFormDataParser(FormDataParser):
+    """FormDataParser that parses multipart bodies with ``UploadParser``."""
+
+    def __init__(self, field, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.field = field
+
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        parser = UploadParser(
+            self.field,
+            stream_factory=self.stream_factory,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.cls,
+        )
+        boundary = options.get("boundary", "").encode("ascii")
+        if not boundary:
+            raise ValueError("Missing boundary")
+        form, files = parser.parse(stream, boundary, content_length)
+        return stream, form, files
+
+
+class ImageUploads:
+    """Stream image uploads to disk and store them under their content hash."""
+
+    def __init__(self, directory, app=None, max_size=MAX_UPLOAD_SIZE, field=UPLOAD_FIELD):
+        self.directory = directory
+        self.max_size = max_size
+        self.field = field
+        self._endpoints = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config.get('MAX_IMAGE_UPLOAD_SIZE', self.max_size)
+        uploads = self
+
+        class UploadRequest(app.request_class):
+            @property
+            def max_content_length(self):
+                if self.endpoint in uploads._endpoints:
+                    return uploads.max_size + MAX_FORM_OVERHEAD
+                return super().max_content_length
+
+            def make_form_data_parser(self):
+                if self.endpoint not in uploads._endpoints:
+                    return super().make_form_data_parser()
+                return UploadFormDataParser(
+                    uploads.field,
+                    stream_factory=self._get_file_stream,
+                    max_form_memory_size=self.max_form_memory_size,
+                    max_content_length=self.max_content_length,
+                    max_form_parts=self.max_form_parts,
+                    cls=self.parameter_storage_class,
+                )
+
+            def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+                if self.endpoint in uploads._endpoints:
+                    return uploads._open_part()
+                return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        app.request_class = UploadRequest
+        app.teardown_request(self._discard_parts)
+
+    def accepts(self, view):
+        """Stream this view's image upload into the uploads directory."""
+        self._endpoints.add(view.__name__)
+        return view
+
+    def save(self, storage):
+        """Store an uploaded file under its content hash.
+
+        Returns its name relative to the images directory (e.g.
+        ``uploads/<sha256>.png``), or None if the part was empty. Raises
+        ``UploadRejected`` if it isn't a PNG, JPEG, GIF or WebP image.
+        """
+        part = storage.stream
+        if not isinstance(part, HashingFile) or part.size == 0:
+            return None
+
+        part.seek(0)
+        extension = image_extension(part.read(SIGNATURE_BYTES))
+        if extension is None:
+            raise UploadRejected("Images must be PNG, JPEG, GIF or WebP files.")
+
+        name = f'{part.hexdigest()}.{extension}'
+        target = os.path.join(self.directory, name)
+        part.close()
+        if os.path.exists(target):
+            # Uploaded before: the same bytes are already stored, and other
+            # projects may use them
+            os.remove(part.path)
+        else:
+            # mkstemp makes the file private; nginx has to be able to read it
+            os.chmod(part.path, 0o644)
+            os.replace(part.path, target)
+            g.setdefault('_upload_created', []).append(target)
+        return f'{UPLOADS_DIRNAME}/{name}'
+
+    def discard_saved(self):
+        """Delete the files this request added to the uploads directory."""
+        for path in g.pop('_upload_created', ()):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _open_part(self):
+        os.makedirs(self.directory, exist_ok=True)
+        part = HashingFile(self.directory, self.max_size)
+        g.setdefault('_upload_parts', []).append(part)
+        return part
+
+    def _discard_parts(self, exception=None):
+        for part in g.pop('_upload_parts', ()):
+            part.discard()
+
+
+def image_extension(head):
+    """Return the extension for an image starting with ``head``, or None."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None